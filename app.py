@@ -3,16 +3,37 @@
 #----------------------------------------------------------------------------#
 
 import json
+import base64
+import csv
+import gzip
+import io
+import os
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+import babel.dates
+import functools
+import hashlib
+import itertools
+import math
+from functools import wraps
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, abort, g, has_request_context, jsonify, stream_with_context, make_response, session
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, insert as pg_insert
 import logging, sys
 from logging import Formatter, FileHandler
 from flask_wtf import FlaskForm
 from forms import *
+from cache import PageCache
+from typeahead import Typeahead
+from matchmaking import Matchmaker
+import geo
+from instrumentation import TimedQueuePool, RequestProfiler, PrometheusMetrics, count_statements, internal_only
+from routing import RoutingSQLAlchemy, reads_from_replica, reads_from_primary
 from flask_migrate import Migrate
+from werkzeug.datastructures import MultiDict
 import datetime
 #----------------------------------------------------------------------------#
 # App Config.
@@ -21,7 +42,10 @@ import datetime
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', TimedQueuePool)
+TimedQueuePool.slow_checkout_ms = app.config['DB_POOL_SLOW_CHECKOUT_MS']
+TimedQueuePool.logger = app.logger
+db = RoutingSQLAlchemy(app)
 
 # TODO: connect to a local postgresql database
 
@@ -31,11 +55,27 @@ db = SQLAlchemy(app)
 
 class Show(db.Model):
     __tablename__ = 'show'
+    __table_args__ = (
+      db.Index('ix_show_start_time_id', 'start_time', 'id'),
+      db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+      db.Index('ix_show_updated_at', 'updated_at'),
+      db.CheckConstraint('end_time > start_time', name='ck_show_end_after_start'),
+      # No venue or artist is booked for two overlapping shows. The GiST
+      # indexes behind these (btree_gist) also answer availability queries.
+      ExcludeConstraint(('venue_id', '='), (db.func.tsrange(db.column('start_time'), db.column('end_time')), '&&'),
+                        name='ex_show_venue_id_during', using='gist'),
+      ExcludeConstraint(('artist_id', '='), (db.func.tsrange(db.column('start_time'), db.column('end_time')), '&&'),
+                        name='ex_show_artist_id_during', using='gist'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime(timezone=False), nullable=False)
+    # Shows occupy [start_time, end_time).
+    end_time = db.Column(db.DateTime(timezone=False), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=False), nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now, server_default=db.func.now())
     artist = db.relationship('Artist', back_populates='shows')
     venue = db.relationship('Venue', back_populates='shows')
 
@@ -44,6 +84,14 @@ class Show(db.Model):
 
 class Venue(db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+      db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_venue_state_city_id', 'state', 'city', 'id'),
+      db.Index('ix_venue_lower_city', db.text('lower(city)')),
+      db.Index('ix_venue_updated_at', 'updated_at'),
+      db.Index('ix_venue_genres', 'genres', postgresql_using='gin'),
+      db.Index('ix_venue_geo_cell', 'geo_cell'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -57,6 +105,14 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String)
+    # Maintained by adjust_upcoming_show_counts(), `flask roll-shows` and `flask recount`.
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Looked up in the geocode gazetteer by geocode_venue() and `flask geocode venues`;
+    # geo_cell is the grid cell of geo.py that radius searches go through.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geo_cell = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime(timezone=False), nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now, server_default=db.func.now())
     shows = db.relationship('Show', back_populates='venue', lazy=True, cascade='all, delete', passive_deletes=True)
 
     def __repr__(self):
@@ -66,6 +122,11 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+      db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_artist_updated_at', 'updated_at'),
+      db.Index('ix_artist_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -78,6 +139,9 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String)
+    # Maintained by adjust_upcoming_show_counts(), `flask roll-shows` and `flask recount`.
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=False), nullable=False, default=datetime.datetime.now, onupdate=datetime.datetime.now, server_default=db.func.now())
     shows = db.relationship('Show', back_populates='artist', lazy=True, cascade='all, delete', passive_deletes=True)
 
     def __repr__(self):
@@ -85,23 +149,585 @@ class Artist(db.Model):
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+class Deletion(db.Model):
+    __tablename__ = 'deletion'
+    __table_args__ = (
+      db.Index('ix_deletion_kind_deleted_at', 'kind', 'deleted_at'),
+    )
+
+    # Tombstones for incremental exports, one per deleted venue, artist or
+    # show (cascaded show deletes included), written by the record_deletion
+    # trigger below. Rows older than every consumer's last snapshot can be
+    # deleted.
+    id = db.Column(db.BigInteger, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime(timezone=False), nullable=False, server_default=db.func.now())
+
+# Installed by db.create_all(); the migration installs the same for existing
+# databases. now() is the transaction's start, like updated_at's default.
+RECORD_DELETION_DDL = '''
+CREATE OR REPLACE FUNCTION record_deletion() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO deletion (kind, record_id, deleted_at) VALUES (TG_TABLE_NAME, OLD.id, now());
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+''' + ''.join(f'''
+DROP TRIGGER IF EXISTS {table}_record_deletion ON {table};
+CREATE TRIGGER {table}_record_deletion AFTER DELETE ON {table}
+  FOR EACH ROW EXECUTE PROCEDURE record_deletion();
+''' for table in ('venue', 'artist', 'show'))
+
+db.event.listen(db.metadata, 'after_create', db.DDL(RECORD_DELETION_DDL).execute_if(dialect='postgresql'))
+
+class Geocode(db.Model):
+    __tablename__ = 'geocode'
+
+    # Offline gazetteer of city centres, loaded with `flask geocode load`.
+    # city is stored trimmed and lowercased.
+    city = db.Column(db.String(120), primary_key=True)
+    state = db.Column(db.String(120), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    geo_cell = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+      return f'<Geocode: {self.city}, {self.state}>'
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 migrate = Migrate(app, db)
+page_cache = PageCache(app)
+typeahead = Typeahead(app)
+typeahead.register('venue', lambda: db.session.query(Venue.id, Venue.name).all())
+typeahead.register('artist', lambda: db.session.query(Artist.id, Artist.name).all())
+matchmaker = Matchmaker(app)
+matchmaker.register('venue',
+                    lambda: db.session.query(Venue.id, Venue.genres, Venue.city, Venue.state).filter(Venue.seeking_talent).all(),
+                    lambda venue_id: past_shows_together(Show.venue_id, Show.artist_id, venue_id))
+matchmaker.register('artist',
+                    lambda: db.session.query(Artist.id, Artist.genres, Artist.city, Artist.state).filter(Artist.seeking_venue).all(),
+                    lambda artist_id: past_shows_together(Show.artist_id, Show.venue_id, artist_id))
+profiler = RequestProfiler(app)
+metrics = PrometheusMetrics(app)
+
+#----------------------------------------------------------------------------#
+# Query guard.
+#----------------------------------------------------------------------------#
+
+# In debug mode every request counts the statements it sends to the database
+# and complains when it exceeds QUERY_COUNT_LIMIT, which is how per-row
+# query patterns (N+1 lazy loads, COUNT per row) show up during development.
+
+class TooManyQueries(Exception):
+  pass
+
+count_statements(app)
+
+@app.after_request
+def check_query_count(response):
+  limit = app.config.get('QUERY_COUNT_LIMIT')
+  query_count = g.get('query_count', 0)
+  if app.debug and limit is not None and query_count > limit:
+    message = f'{request.method} {request.path} issued {query_count} queries (limit {limit})'
+    if app.config.get('QUERY_COUNT_RAISE'):
+      raise TooManyQueries(message)
+    app.logger.warning(message)
+  return response
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@functools.lru_cache(maxsize=None)
+def compiled_datetime_pattern(format, locale):
+  # Locale lookup and pattern parsing are done once per (format, locale).
+  return babel.Locale.parse(locale), babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+@functools.lru_cache(maxsize=4096)
+def format_datetime_cached(date, format, locale):
+  # Shows share a small set of start times, so repeated values are memoized.
+  locale, pattern = compiled_datetime_pattern(format, locale)
+  return pattern.apply(date, locale)
+
+def format_datetime(value, format='medium', locale=None):
+  # Accepts datetime objects as well as the date strings used previously.
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  return format_datetime_cached(value, format, locale or app.config['DATETIME_LOCALE'])
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def search_by_name(model, search_term, limit=None, criteria=(), point=None):
+  # Case-insensitive partial match on model.name, narrowed by any extra
+  # criteria. The ILIKE is served by the pg_trgm GIN index on name; results
+  # are ranked by trigram similarity to the search term and capped at
+  # SEARCH_RESULT_LIMIT.
+  # With a venue `point` (see geo_point()) matches are instead the nearest,
+  # or those within its radius, closest first, with a distance_km column.
+  # Returns (total number of matches, [(id, name, upcoming_shows_count), ...]).
+  if limit is None:
+    limit = app.config['SEARCH_RESULT_LIMIT']
+  escaped_term = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+  query = model.query.filter(model.name.ilike('%' + escaped_term + '%', escape='\\'), *criteria)
+  columns = (model.id, model.name, model.upcoming_shows_count)
+  if point is not None:
+    latitude, longitude, radius = point
+    count = (query if radius is None else within_radius(query, latitude, longitude, radius)).count()
+    return count, nearby(query.with_entities(*columns), point, limit).all()
+  count = query.count()
+  rows = query.with_entities(*columns).order_by(
+    db.func.similarity(model.name, search_term).desc(),
+    model.name,
+    model.id
+  ).limit(limit).all()
+  return count, rows
+
+def genre_array(genres):
+  return db.cast(list(genres), db.ARRAY(db.Text()))
+
+def genre_criteria(column, args):
+  # Genre facet filters from request arguments or form data: the row has
+  # every `genre` given (@>) and at least one `genre_any`, if given (&&).
+  # Both are served by the GIN indexes on genres.
+  criteria = []
+  all_of = [genre for genre in args.getlist('genre') if genre]
+  any_of = [genre for genre in args.getlist('genre_any') if genre]
+  if all_of:
+    criteria.append(column.op('@>')(genre_array(all_of)))
+  if any_of:
+    criteria.append(column.op('&&')(genre_array(any_of)))
+  return criteria
+
+def genre_counts(model, criteria=()):
+  # [(genre, number of rows of model listing it), ...], most common first,
+  # in one query.
+  genres = db.session.query(db.func.unnest(model.genres).label('genre')).filter(*criteria).subquery()
+  count = db.func.count().label('count')
+  return db.session.query(genres.c.genre, count).group_by(genres.c.genre).order_by(count.desc(), genres.c.genre).all()
+
+def geo_point(args):
+  # (latitude, longitude, radius in km) from lat, lng and radius request
+  # arguments or form data; radius is None without one, for the nearest
+  # venues. None when no point is given.
+  if not args.get('lat') and not args.get('lng'):
+    return None
+  try:
+    latitude, longitude = float(args['lat']), float(args['lng'])
+    radius = float(args['radius']) if args.get('radius') else None
+  except (KeyError, ValueError):
+    abort(400, description='lat, lng and radius must be numbers')
+  if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or (radius is not None and not radius > 0):
+    abort(400, description='lat must be within [-90, 90], lng within [-180, 180] and radius positive')
+  return latitude, longitude, None if radius is None else min(radius, geo.MAX_DISTANCE_KM)
+
+def distance_km(latitude, longitude):
+  # Great-circle (haversine) distance in km from a point to each venue, in SQL.
+  venue_latitude = db.func.radians(Venue.latitude)
+  half_dlat = (venue_latitude - math.radians(latitude)) / 2
+  half_dlon = (db.func.radians(Venue.longitude) - math.radians(longitude)) / 2
+  a = (db.func.power(db.func.sin(half_dlat), 2) +
+       math.cos(math.radians(latitude)) * db.func.cos(venue_latitude) * db.func.power(db.func.sin(half_dlon), 2))
+  return 2 * geo.EARTH_RADIUS_KM * db.func.asin(db.func.least(1.0, db.func.sqrt(a)))
+
+def within_radius(query, latitude, longitude, radius):
+  # Venues within radius km. The geo_cell ranges find candidates on
+  # ix_venue_geo_cell; the distance then filters them exactly. Venues
+  # without coordinates have no cell and never match.
+  cells = [Venue.geo_cell.between(first, last) for first, last in geo.cell_ranges(latitude, longitude, radius)]
+  return query.filter(db.or_(*cells), distance_km(latitude, longitude) <= radius)
+
+def nearest_radius(query, latitude, longitude, count):
+  # The smallest radius, growing from NEAREST_VENUES_START_KM fourfold at a
+  # time, holding at least `count` of the query's venues. Each probe reads
+  # at most `count` ids. Remembered for the request, as the conditional GET
+  # validator and the view ask the same question.
+  ids = query.with_entities(Venue.id)
+  statement = ids.statement.compile()
+  key = (str(statement), json.dumps(statement.params, default=str, sort_keys=True), latitude, longitude, count)
+  known = g.setdefault('nearest_radius', {}) if has_request_context() else {}
+  if key not in known:
+    radius = app.config['NEAREST_VENUES_START_KM']
+    while radius < geo.MAX_DISTANCE_KM and len(within_radius(ids, latitude, longitude, radius).limit(count).all()) < count:
+      radius *= 4
+    known[key] = min(radius, geo.MAX_DISTANCE_KM)
+  return known[key]
+
+def nearby(query, point, limit=None):
+  # A venue query narrowed to the point's radius, or to the `limit` venues
+  # nearest to it, adding a distance_km column and ordering by it.
+  latitude, longitude, radius = point
+  if radius is None:
+    limit = limit or app.config['PAGE_SIZE']
+    radius = nearest_radius(query, latitude, longitude, limit)
+  distance = distance_km(latitude, longitude)
+  query = within_radius(query, latitude, longitude, radius).add_columns(distance.label('distance_km')).order_by(distance, Venue.id)
+  return query if limit is None else query.limit(limit)
+
+def nearby_page(query, point):
+  # A listing page of nearby(): venues within the radius are seek-paginated
+  # on (distance_km, id), the distance being recomputed identically for the
+  # cursor comparison; the nearest venues are a single page.
+  # Returns (rows, prev_cursor, next_cursor).
+  latitude, longitude, radius = point
+  if radius is None:
+    return nearby(query, point, page_limit()).all(), None, None
+  distance = distance_km(latitude, longitude).label('distance_km')
+  return keyset_page(within_radius(query, latitude, longitude, radius).add_columns(distance), [distance, Venue.id],
+                     after=request.args.get('after'),
+                     before=request.args.get('before'))
+
+def geocode_venue(venue):
+  # Sets a venue's coordinates from the gazetteer entry for its city, or
+  # clears them when there is none.
+  entry = Geocode.query.get((venue.city.strip().lower(), venue.state))
+  venue.latitude = entry.latitude if entry else None
+  venue.longitude = entry.longitude if entry else None
+  venue.geo_cell = entry.geo_cell if entry else None
+
+def geocode_venues(everything=False):
+  # Copies gazetteer coordinates onto the venues without any (or onto every
+  # venue in the gazetteer) in one UPDATE ... FROM geocode. Returns the
+  # number of venues updated.
+  query = Venue.query.filter(Geocode.city == db.func.lower(db.func.trim(Venue.city)), Geocode.state == Venue.state)
+  if not everything:
+    query = query.filter(Venue.latitude.is_(None))
+  return query.update({
+    Venue.latitude: Geocode.latitude,
+    Venue.longitude: Geocode.longitude,
+    Venue.geo_cell: Geocode.geo_cell,
+    Venue.updated_at: db.func.now(),
+  }, synchronize_session=False)
+
+def venue_page_keys(venue_id):
+  # Cached pages that show data about the venue: its own page and the page
+  # of every artist with a show there.
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+  return [('venue', venue_id)] + [('artist', row.artist_id) for row in artist_ids]
+
+def artist_page_keys(artist_id):
+  # Cached pages that show data about the artist: its own page and the page
+  # of every venue where the artist has a show.
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+  return [('artist', artist_id)] + [('venue', row.venue_id) for row in venue_ids]
+
+def upcoming_shows_count_subquery(model, now):
+  # Live count of a venue's or artist's upcoming shows, correlated to `model`.
+  fk_column = Show.venue_id if model is Venue else Show.artist_id
+  return db.select([db.func.count(Show.id)]).where(fk_column == model.id).where(Show.start_time > now).as_scalar()
+
+def adjust_upcoming_show_counts(shows, delta, now=None):
+  # Adds delta to upcoming_shows_count of the venue and artist of every
+  # upcoming show in `shows` ((venue_id, artist_id, start_time) tuples), in
+  # the current transaction, with one UPDATE per table.
+  if now is None:
+    now = datetime.datetime.now()
+  for model, index in ((Venue, 0), (Artist, 1)):
+    changes = {}
+    for show in shows:
+      if show[2] > now:
+        changes[show[index]] = changes.get(show[index], 0) + delta
+    if changes:
+      db.session.execute(
+        model.__table__.update().where(model.id == db.bindparam('entity_id')).values(
+          upcoming_shows_count=model.upcoming_shows_count + db.bindparam('delta')),
+        [{'entity_id': entity_id, 'delta': change} for entity_id, change in changes.items()]
+      )
+
+def past_shows_together(fk_column, other_fk_column, entity_id):
+  # {other side id: number of past shows with it} for one venue or artist.
+  return dict(db.session.query(other_fk_column, db.func.count(Show.id)).filter(
+    fk_column == entity_id, Show.start_time <= datetime.datetime.now()
+  ).group_by(other_fk_column).all())
+
+def upcoming_shows_for(fk_column, entity_id):
+  # (venue_id, artist_id, start_time) of the venue's or artist's upcoming
+  # shows, for adjust_upcoming_show_counts() before they are deleted.
+  return db.session.query(Show.venue_id, Show.artist_id, Show.start_time).filter(
+    fk_column == entity_id,
+    Show.start_time > datetime.datetime.now()
+  ).all()
+
+def recount_upcoming_shows(model, now, ids=None):
+  # Recomputes upcoming_shows_count from the show table, for the given ids
+  # or for every row. Returns the number of rows whose count was wrong.
+  stale = model.upcoming_shows_count != upcoming_shows_count_subquery(model, now)
+  if ids is not None:
+    stale = db.and_(model.id.in_(ids), stale)
+  result = db.session.execute(
+    model.__table__.update().where(stale).values(upcoming_shows_count=upcoming_shows_count_subquery(model, now)))
+  return result.rowcount
+
+def venue_shows(venue_id):
+  # Every show at the venue with its artist, ordered by start time.
+  return Show.query.join('artist').with_entities(
+    Artist.id.label('artist_id'), Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'), Show.start_time).filter(
+    Show.venue_id == venue_id
+  ).order_by(Show.start_time).all()
+
+def artist_shows(artist_id):
+  # Every show by the artist with its venue, ordered by start time.
+  return Show.query.join('venue').with_entities(
+    Venue.id.label('venue_id'), Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'), Show.start_time).filter(
+    Show.artist_id == artist_id
+  ).order_by(Show.start_time).all()
+
+def split_shows(shows, now):
+  # Splits shows into (past, upcoming) lists of dicts against one timestamp,
+  # so every show lands in exactly one list.
+  past_shows, upcoming_shows = [], []
+  for show in shows:
+    (past_shows if show.start_time <= now else upcoming_shows).append(show._asdict())
+  return past_shows, upcoming_shows
+
+def show_listing_query():
+  # Shows joined to their venue and artist, projected to the listing columns
+  # so nothing is lazy-loaded per show.
+  return db.session.query(
+    Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+    Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link')
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+
+def show_end_time(start_time, end_time=None, duration=None):
+  # Shows given neither an end time nor a duration (in minutes) last
+  # SHOW_DEFAULT_DURATION_MINUTES.
+  if end_time is not None:
+    return end_time
+  return start_time + datetime.timedelta(minutes=duration or app.config['SHOW_DEFAULT_DURATION_MINUTES'])
+
+def booking_conflicts(fk_column, entity_id, start_time, end_time):
+  # Shows of one venue or artist (fk_column) overlapping [start_time,
+  # end_time). The predicate is the exclusion constraints' own, so it is an
+  # index lookup on their GiST index rather than a scan of every show.
+  during = db.func.tsrange(Show.start_time, Show.end_time)
+  return Show.query.filter(
+    fk_column == entity_id,
+    during.op('&&')(db.func.tsrange(start_time, end_time))
+  ).order_by(Show.start_time)
+
+def local_datetime(text):
+  # Show times are naive local time; offsets given by the client are
+  # converted to it. Raises ValueError or OverflowError on a bad date-time.
+  value = dateutil.parser.parse(text)
+  if value.tzinfo is not None:
+    value = value.astimezone().replace(tzinfo=None)
+  return value
+
+def local_datetime_arg(name):
+  try:
+    return local_datetime(request.args[name])
+  except (KeyError, ValueError, OverflowError):
+    abort(400, description=f'{name} must be an ISO 8601 date-time')
+
+def show_filters():
+  # Criteria for the shows filter arguments, and the models they need
+  # joined: from / to (start_time in [from, to)), venue_id, artist_id, city
+  # and state (the venue's) and genre / genre_any (the artist's, see
+  # genre_criteria). Empty arguments, as sent by the listing's filter form,
+  # are ignored.
+  criteria, joins = [], set()
+  if request.args.get('from'):
+    criteria.append(Show.start_time >= local_datetime_arg('from'))
+  if request.args.get('to'):
+    criteria.append(Show.start_time < local_datetime_arg('to'))
+  for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+    if request.args.get(name):
+      value = request.args.get(name, type=int)
+      if value is None:
+        abort(400, description=f'{name} must be an integer')
+      criteria.append(column == value)
+  if request.args.get('city'):
+    criteria.append(db.func.lower(Venue.city) == request.args['city'].lower())
+    joins.add(Venue)
+  if request.args.get('state'):
+    criteria.append(Venue.state == request.args['state'].upper())
+    joins.add(Venue)
+  genres = genre_criteria(Artist.genres, request.args)
+  if genres:
+    criteria.extend(genres)
+    joins.add(Artist)
+  return criteria, joins
+
+def join_show_models(query, models):
+  # Joins a query over shows to the venue and/or artist tables.
+  if Venue in models:
+    query = query.join(Venue, Show.venue_id == Venue.id)
+  if Artist in models:
+    query = query.join(Artist, Show.artist_id == Artist.id)
+  return query
+
+def encode_cursor(values):
+  # Opaque, URL-safe page cursor holding the sort key of a row.
+  raw = json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else v for v in values])
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+  # Inverse of encode_cursor(). Aborts with 400 on a malformed cursor.
+  try:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list) or len(values) != len(columns):
+      raise ValueError(cursor)
+    return tuple(datetime.datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else v
+                 for c, v in zip(columns, values))
+  except (ValueError, TypeError):
+    abort(400)
+
+def page_limit(limit=None):
+  # Clamps a requested page size to [1, MAX_PAGE_SIZE], defaulting to PAGE_SIZE.
+  if limit is None:
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+  return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+def keyset_page(query, columns, after=None, before=None, limit=None):
+  # Seek pagination over `columns`, which must uniquely order the rows (end
+  # with a primary key) and be selected by `query` under their own names.
+  # Each page is a range scan of at most limit + 1 rows on an index over
+  # `columns`, however deep into the table it is.
+  # Returns (rows, prev_cursor, next_cursor); cursors are None at either end.
+  limit = page_limit(limit)
+  key = db.tuple_(*columns)
+
+  def cursor_for(row):
+    return encode_cursor([getattr(row, column.key) for column in columns])
+
+  if before is not None:
+    rows = query.filter(key < decode_cursor(before, columns)).order_by(
+      *[column.desc() for column in columns]
+    ).limit(limit + 1).all()
+    has_prev = len(rows) > limit
+    rows = rows[:limit][::-1]
+    prev_cursor = cursor_for(rows[0]) if has_prev else None
+    next_cursor = cursor_for(rows[-1]) if rows else None
+  else:
+    if after is not None:
+      query = query.filter(key > decode_cursor(after, columns))
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    prev_cursor = cursor_for(rows[0]) if after is not None and rows else None
+    next_cursor = cursor_for(rows[-1]) if has_next else None
+  return rows, prev_cursor, next_cursor
+
+def pagination_links(prev_cursor, next_cursor):
+  # Prev/next URLs for the current endpoint, keeping the requested limit and
+  # filters, including repeated ones such as genre.
+  args = {k: v for k, v in request.args.to_dict(flat=False).items() if k not in ('after', 'before')}
+  return {
+    'prev': url_for(request.endpoint, before=prev_cursor, **args) if prev_cursor else None,
+    'next': url_for(request.endpoint, after=next_cursor, **args) if next_cursor else None,
+  }
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+# Pages declare a cheap validator: a function returning the newest
+# updated_at their content depends on and the values that identify that
+# content (row ids, timestamps, counts). The ETag is a hash of those values
+# and the URL, and a matching If-None-Match gets a 304 before the page's own
+# queries run.
+
+def listing_version(query, columns):
+  # The rows on the requested listing page and whether there are pages on
+  # either side. `query` selects the keyset columns followed by the
+  # updated_at columns of every table the page shows. Row ids cover
+  # deletes, which leave no updated_at behind.
+  rows, prev_cursor, next_cursor = keyset_page(query, columns,
+                                               after=request.args.get('after'),
+                                               before=request.args.get('before'))
+  timestamps = [value for row in rows for value in row[len(columns):] if value is not None]
+  values = [list(row) for row in rows] + [prev_cursor is not None, next_cursor is not None]
+  return max(timestamps, default=None), values
+
+def venues_version():
+  query = db.session.query(Venue.state, Venue.city, Venue.id, Venue.updated_at).filter(
+    *genre_criteria(Venue.genres, request.args))
+  point = geo_point(request.args)
+  if point is not None:
+    rows, prev_cursor, next_cursor = nearby_page(query, point)
+    return (max((row.updated_at for row in rows), default=None),
+            [list(row) for row in rows] + [prev_cursor is not None, next_cursor is not None])
+  return listing_version(query, [Venue.state, Venue.city, Venue.id])
+
+def artists_version():
+  return listing_version(db.session.query(Artist.id, Artist.updated_at).filter(
+    *genre_criteria(Artist.genres, request.args)), [Artist.id])
+
+def shows_version():
+  criteria, _ = show_filters()
+  return listing_version(db.session.query(
+    Show.start_time, Show.id, Show.updated_at,
+    Venue.updated_at.label('venue_updated_at'), Artist.updated_at.label('artist_updated_at')
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id).filter(*criteria),
+    [Show.start_time, Show.id])
+
+def entity_version(model, entity_id):
+  # The entity's updated_at plus a summary of its shows and of the other
+  # side of each show; the past show count moves as shows start.
+  other = Artist if model is Venue else Venue
+  fk_column = Show.venue_id if model is Venue else Show.artist_id
+  other_fk_column = Show.artist_id if model is Venue else Show.venue_id
+  entity = db.session.query(model.updated_at).filter(model.id == entity_id).first()
+  if entity is None:
+    return None, [None]
+  shows = db.session.query(
+    db.func.count(Show.id),
+    db.func.count(db.case([(Show.start_time <= datetime.datetime.now(), Show.id)])),
+    db.func.max(Show.updated_at),
+    db.func.max(other.updated_at)
+  ).join(other, other_fk_column == other.id).filter(fk_column == entity_id).one()
+  timestamps = [value for value in (entity.updated_at,) + tuple(shows[2:]) if value is not None]
+  return max(timestamps), [entity.updated_at] + list(shows)
+
+def http_datetime(value):
+  # updated_at is naive local time; HTTP dates are UTC with second precision.
+  return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+def conditional(version):
+  # Decorates a GET view with ETag / Last-Modified / Cache-Control handling.
+  # `version` receives the view's arguments and returns
+  # (last modified, values).
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      cache_control = app.config['CACHE_CONTROL'].get(request.endpoint, app.config['CACHE_CONTROL_DEFAULT'])
+      # Pages carrying flashed messages are per-user and one-off.
+      if session.get('_flashes'):
+        response = make_response(view(*args, **kwargs))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+      last_modified, values = version(*args, **kwargs)
+      raw = json.dumps([request.full_path] + values, default=json_default, sort_keys=True)
+      etag = hashlib.sha1(raw.encode()).hexdigest()
+      if last_modified is not None:
+        last_modified = http_datetime(last_modified)
+
+      # If-Modified-Since alone never gets a 304: deletes, cascaded show
+      # deletes and shows moving into the past change a page without moving
+      # its newest updated_at, so only the ETag values notice them.
+      not_modified = bool(request.if_none_match) and request.if_none_match.contains(etag)
+
+      response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+      if response.status_code in (200, 304):
+        response.set_etag(etag)
+        if last_modified is not None:
+          response.last_modified = last_modified
+        response.headers['Cache-Control'] = cache_control
+      return response
+    return wrapper
+  return decorator
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -115,23 +741,41 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@reads_from_replica
+@conditional(venues_version)
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  areas = Venue.query.distinct('city', 'state').all()
-  for area in areas:
-    record = {'city': area.city, 'state': area.state}
-    record['venues'] = []
-    venues = Venue.query.filter(Venue.city == area.city, Venue.state == area.state).all()
-    for venue in venues:
-      num_upcoming_shows = Show.query.filter(Show.venue_id == venue.id).filter(Show.start_time > datetime.datetime.now()).count()
-      record['venues'].append({'id': venue.id, 'name': venue.name, 'num_upcoming_shows': num_upcoming_shows})
-    data.append(record)
-  
-  return render_template('pages/venues.html', areas=data)
+  # One query per page: venues are seek-paginated in area order and carry
+  # their maintained upcoming show count. Venues in the same area are
+  # adjacent and are grouped in one pass.
+  # Given lat and lng the page instead holds the nearest venues, or a page
+  # of those within radius km, closest first and grouped by area in that
+  # order.
+  query = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count).filter(
+    *genre_criteria(Venue.genres, request.args))
+  point = geo_point(request.args)
+  if point is not None:
+    rows, prev_cursor, next_cursor = nearby_page(query, point)
+  else:
+    rows, prev_cursor, next_cursor = keyset_page(query, [Venue.state, Venue.city, Venue.id],
+                                                 after=request.args.get('after'),
+                                                 before=request.args.get('before'))
+
+  areas = {}
+  for row in rows:
+    area = areas.setdefault((row.state, row.city), {'city': row.city, 'state': row.state, 'venues': []})
+    venue = {'id': row.id, 'name': row.name, 'num_upcoming_shows': row.upcoming_shows_count}
+    if point is not None:
+      venue['distance_km'] = round(row.distance_km, 1)
+    area['venues'].append(venue)
+  data = list(areas.values())
+
+  return render_template('pages/venues.html', areas=data, genres=[genre for genre, _ in GENRE_CHOICES],
+                         pagination=pagination_links(prev_cursor, next_cursor))
 
 @app.route('/venues/search', methods=['POST'])
+@reads_from_replica
 def search_venues():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
@@ -140,15 +784,30 @@ def search_venues():
   search_results['data'] = []
   search_term = request.form.get('search_term', '')
   
-  venues = Venue.query.filter(Venue.name.ilike('%'+search_term+'%')).all()
-  search_results['count'] = len(venues)
+  point = geo_point(request.form)
+  search_results['count'], venues = search_by_name(Venue, search_term, criteria=genre_criteria(Venue.genres, request.form),
+                                                   point=point)
   for venue in venues:
-    num_upcoming_shows = Show.query.filter(Show.venue_id == venue.id).filter(Show.start_time > datetime.datetime.now()).count()
+    num_upcoming_shows = venue.upcoming_shows_count
     search_results['data'].append({'id': venue.id, 'name': venue.name, 'num_upcoming_shows': num_upcoming_shows})
+    if point is not None:
+      search_results['data'][-1]['distance_km'] = round(venue.distance_km, 1)
   
-  return render_template('pages/search_venues.html', results=search_results, search_term=search_term)
+  return render_template('pages/search_venues.html', results=search_results, search_term=search_term,
+                         genres=[genre for genre, _ in GENRE_CHOICES])
+
+@app.route('/venues/typeahead')
+@reads_from_replica
+def typeahead_venues():
+  # Name suggestions for the search box, from the in-memory prefix index.
+  matches = typeahead.complete('venue', request.args.get('q', ''), request.args.get('limit', type=int))
+  return jsonify({'data': [{'id': venue_id, 'name': name} for venue_id, name in matches]})
 
 @app.route('/venues/<int:venue_id>')
+@reads_from_replica
+@conditional(lambda venue_id: entity_version(Venue, venue_id))
+@page_cache.cached('venue', 'venue_id')
+@reads_from_primary
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -156,27 +815,14 @@ def show_venue(venue_id):
   if venue is None:
     return not_found_error('Venue ID does not exist')
   data = venue.__dict__
-  data['past_shows'] = []
-  data['upcoming_shows'] = []
-  
-  past_shows = Show.query.join('artist').with_entities(
-    Artist.id.label('artist_id'), Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'), Show.start_time).filter(
-    Show.venue_id == venue.id,
-    Show.start_time <= datetime.datetime.now()
-  ).all()
-  data['past_shows_count'] = len(past_shows)
-  for show in past_shows:
-    data['past_shows'].append({'artist_id': show.artist_id, 'artist_name': show.artist_name, 'artist_image_link': show.artist_image_link, 'start_time': str(show.start_time)})
-  
-  upcoming_shows = Show.query.join('artist').with_entities(
-    Artist.id.label('artist_id'), Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'), Show.start_time).filter(
-    Show.venue_id == venue.id,
-    Show.start_time > datetime.datetime.now()
-  ).all()
-  data['upcoming_shows_count'] = len(upcoming_shows)
-  for show in upcoming_shows:
-    data['upcoming_shows'].append({'artist_id': show.artist_id, 'artist_name': show.artist_name, 'artist_image_link': show.artist_image_link, 'start_time': str(show.start_time)})
-  
+  # All of the venue's shows in one query, split against a single timestamp.
+  data['past_shows'], data['upcoming_shows'] = split_shows(venue_shows(venue.id), datetime.datetime.now())
+  data['past_shows_count'] = len(data['past_shows'])
+  data['upcoming_shows_count'] = len(data['upcoming_shows'])
+  if data['upcoming_shows']:
+    # The cached page goes stale when the next show moves to past shows.
+    g.page_cache_expires_at = data['upcoming_shows'][0]['start_time']
+
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -216,8 +862,11 @@ def create_venue_submission():
                   website=website,
                   seeking_talent=seeking_talent,
                   seeking_description=seeking_description)
+    geocode_venue(venue)
     db.session.add(venue)
     db.session.commit()
+    typeahead.add('venue', venue.id, venue.name)
+    matchmaker.profile_changed('venue', venue.id, venue.genres, venue.city, venue.state, venue.seeking_talent)
     # on successful db insert, flash success
     flash('Venue ' + name + ' was successfully listed!')
   except:
@@ -241,8 +890,13 @@ def delete_venue(venue_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   error = False
   try:
+    stale_pages = venue_page_keys(venue_id)
+    adjust_upcoming_show_counts(upcoming_shows_for(Show.venue_id, venue_id), -1)
     Venue.query.filter(Venue.id == venue_id).delete()
     db.session.commit()
+    page_cache.invalidate(stale_pages)
+    typeahead.remove('venue', int(venue_id))
+    matchmaker.profile_changed('venue', int(venue_id))
     flash('Venue successfully deleted.')
   except:
     error = True
@@ -263,8 +917,13 @@ def delete_artist(artist_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   error = False
   try:
+    stale_pages = artist_page_keys(artist_id)
+    adjust_upcoming_show_counts(upcoming_shows_for(Show.artist_id, artist_id), -1)
     Artist.query.filter(Artist.id == artist_id).delete()
     db.session.commit()
+    page_cache.invalidate(stale_pages)
+    typeahead.remove('artist', int(artist_id))
+    matchmaker.profile_changed('artist', int(artist_id))
     flash('Artist successfully deleted.')
   except:
     error = True
@@ -282,13 +941,20 @@ def delete_artist(artist_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@reads_from_replica
+@conditional(artists_version)
 def artists():
   # TODO: replace with real data returned from querying the database
-  artists = Artist.query.with_entities(Artist.id, Artist.name).order_by('id').all()
-  
-  return render_template('pages/artists.html', artists=artists)
+  query = Artist.query.with_entities(Artist.id, Artist.name).filter(*genre_criteria(Artist.genres, request.args))
+  artists, prev_cursor, next_cursor = keyset_page(query, [Artist.id],
+                                                  after=request.args.get('after'),
+                                                  before=request.args.get('before'))
+
+  return render_template('pages/artists.html', artists=artists, genres=[genre for genre, _ in GENRE_CHOICES],
+                         pagination=pagination_links(prev_cursor, next_cursor))
 
 @app.route('/artists/search', methods=['POST'])
+@reads_from_replica
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
@@ -297,15 +963,26 @@ def search_artists():
   search_results['data'] = []
   search_term = request.form.get('search_term', '')
 
-  artists = Artist.query.filter(Artist.name.ilike('%'+search_term+'%')).all()
-  search_results['count'] = len(artists)
+  search_results['count'], artists = search_by_name(Artist, search_term, criteria=genre_criteria(Artist.genres, request.form))
   for artist in artists:
-    num_upcoming_shows = Show.query.filter(Show.artist_id == artist.id).filter(Show.start_time > datetime.datetime.now()).count()
+    num_upcoming_shows = artist.upcoming_shows_count
     search_results['data'].append({'id': artist.id, 'name': artist.name, 'num_upcoming_shows': num_upcoming_shows})
   
-  return render_template('pages/search_artists.html', results=search_results, search_term=search_term)
+  return render_template('pages/search_artists.html', results=search_results, search_term=search_term,
+                         genres=[genre for genre, _ in GENRE_CHOICES])
+
+@app.route('/artists/typeahead')
+@reads_from_replica
+def typeahead_artists():
+  # Name suggestions for the search box, from the in-memory prefix index.
+  matches = typeahead.complete('artist', request.args.get('q', ''), request.args.get('limit', type=int))
+  return jsonify({'data': [{'id': artist_id, 'name': name} for artist_id, name in matches]})
 
 @app.route('/artists/<int:artist_id>')
+@reads_from_replica
+@conditional(lambda artist_id: entity_version(Artist, artist_id))
+@page_cache.cached('artist', 'artist_id')
+@reads_from_primary
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -314,27 +991,14 @@ def show_artist(artist_id):
     return not_found_error('Artist ID does not exist')
   
   data = artist.__dict__
-  data['past_shows'] = []
-  data['upcoming_shows'] = []
-  
-  past_shows = Show.query.join('venue').with_entities(
-    Venue.id.label('venue_id'), Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'), Show.start_time).filter(
-    Show.artist_id == artist.id,
-    Show.start_time <= datetime.datetime.now()
-  ).all()
-  data['past_shows_count'] = len(past_shows)
-  for show in past_shows:
-    data['past_shows'].append({'venue_id': show.venue_id, 'venue_name': show.venue_name, 'venue_image_link': show.venue_image_link, 'start_time': str(show.start_time)})
-  
-  upcoming_shows = Show.query.join('venue').with_entities(
-    Venue.id.label('venue_id'), Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'), Show.start_time).filter(
-    Show.artist_id == artist.id,
-    Show.start_time > datetime.datetime.now()
-  ).all()
-  data['upcoming_shows_count'] = len(upcoming_shows)
-  for show in upcoming_shows:
-    data['upcoming_shows'].append({'venue_id': show.venue_id, 'venue_name': show.venue_name, 'venue_image_link': show.venue_image_link, 'start_time': str(show.start_time)})
-  
+  # All of the artist's shows in one query, split against a single timestamp.
+  data['past_shows'], data['upcoming_shows'] = split_shows(artist_shows(artist.id), datetime.datetime.now())
+  data['past_shows_count'] = len(data['past_shows'])
+  data['upcoming_shows_count'] = len(data['upcoming_shows'])
+  if data['upcoming_shows']:
+    # The cached page goes stale when the next show moves to past shows.
+    g.page_cache_expires_at = data['upcoming_shows'][0]['start_time']
+
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -364,8 +1028,12 @@ def edit_artist_submission(artist_id):
     artist.website = request.form.get('website', '')
     artist.seeking_venue = request.form.get('seeking_venue') != None
     artist.seeking_description = request.form.get('seeking_description', '')
+    stale_pages = artist_page_keys(artist_id)
     
     db.session.commit()
+    page_cache.invalidate(stale_pages)
+    typeahead.add('artist', artist_id, artist.name)
+    matchmaker.profile_changed('artist', artist_id, artist.genres, artist.city, artist.state, artist.seeking_venue)
     # on successful db insert, flash success
     flash('Artist ' + artist.name + ' was successfully updated!')
   except:
@@ -405,8 +1073,13 @@ def edit_venue_submission(venue_id):
     venue.website = request.form.get('website', '')
     venue.seeking_talent = request.form.get('seeking_talent') != None
     venue.seeking_description = request.form.get('seeking_description', '')
+    geocode_venue(venue)
+    stale_pages = venue_page_keys(venue_id)
     
     db.session.commit()
+    page_cache.invalidate(stale_pages)
+    typeahead.add('venue', venue_id, venue.name)
+    matchmaker.profile_changed('venue', venue_id, venue.genres, venue.city, venue.state, venue.seeking_talent)
     # on successful db insert, flash success
     flash('Venue ' + venue.name + ' was successfully updated!')
   except:
@@ -459,6 +1132,8 @@ def create_artist_submission():
                   seeking_description=seeking_description)
     db.session.add(artist)
     db.session.commit()
+    typeahead.add('artist', artist.id, artist.name)
+    matchmaker.profile_changed('artist', artist.id, artist.genres, artist.city, artist.state, artist.seeking_venue)
     # on successful db insert, flash success
     flash('Artist ' + name + ' was successfully listed!')
   except:
@@ -481,21 +1156,20 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@reads_from_replica
+@conditional(shows_version)
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  shows = Show.query.order_by('venue_id').all()
-  for show in shows:
-    data.append({'venue_id': show.venue.id,
-                 'venue_name': show.venue.name,
-                 'artist_id': show.artist.id,
-                 'artist_name': show.artist.name,
-                 'artist_image_link': show.artist.image_link,
-                 'start_time': str(show.start_time)})
+  criteria, _ = show_filters()
+  shows, prev_cursor, next_cursor = keyset_page(show_listing_query().filter(*criteria), [Show.start_time, Show.id],
+                                                after=request.args.get('after'),
+                                                before=request.args.get('before'))
+  data = [show._asdict() for show in shows]
 
-  return render_template('pages/shows.html', shows=data)
+  return render_template('pages/shows.html', shows=data, genres=[genre for genre, _ in GENRE_CHOICES],
+                         pagination=pagination_links(prev_cursor, next_cursor))
 
 @app.route('/shows/create')
 def create_shows():
@@ -508,16 +1182,44 @@ def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
   error = False
+  conflict = None
+  invalid = None
+  # The same validation as `flask import shows`: ids, times and a positive
+  # duration; bad input gets the form back rather than a 500.
+  values, errors = validate_record(Show, ShowForm, request.form)
+  if errors:
+    flash('Show could not be listed. ' + '; '.join(f'{field}: {" ".join(messages)}' for field, messages in errors.items()))
+    return render_template('forms/new_show.html', form=ShowForm(request.form)), 400
   try:
-    artist_id = request.form.get('artist_id', '')
-    venue_id = request.form.get('venue_id', '')
-    start_time = request.form.get('start_time', '')
+    artist_id, venue_id = values['artist_id'], values['venue_id']
+    start_time, end_time = values['start_time'], values['end_time']
 
-    show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-    db.session.add(show)
-    db.session.commit()
-    # on successful db insert, flash success
-    flash('Show was successfully listed!')
+    if booking_conflicts(Show.venue_id, venue_id, start_time, end_time).first() is not None:
+      conflict = 'The venue is already booked at that time.'
+    elif booking_conflicts(Show.artist_id, artist_id, start_time, end_time).first() is not None:
+      conflict = 'The artist is already booked at that time.'
+    else:
+      show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time, end_time=end_time)
+      db.session.add(show)
+      adjust_upcoming_show_counts([(venue_id, artist_id, start_time)], 1)
+      db.session.commit()
+      page_cache.invalidate([('venue', venue_id), ('artist', artist_id)])
+      # on successful db insert, flash success
+      flash('Show was successfully listed!')
+  except exc.IntegrityError as e:
+    db.session.rollback()
+    pgcode = getattr(e.orig, 'pgcode', None)
+    if pgcode == '23P01':
+      # A concurrent booking got there first; the exclusion constraints refuse the overlap.
+      conflict = 'The venue or artist was booked at that time in the meantime.'
+    elif pgcode == '23503':
+      # No such artist or venue (or it was deleted meanwhile): the foreign keys refuse the show.
+      constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None) or ''
+      missing = 'artist' if 'artist' in constraint else 'venue' if 'venue' in constraint else 'artist or venue'
+      invalid = f'There is no {missing} with that ID.'
+    else:
+      error = True
+      print(sys.exc_info())
   except:
     error = True
     db.session.rollback()
@@ -527,11 +1229,38 @@ def create_show_submission():
   if error:
     flash('An error occurred. Show could not be listed.')
     abort(500)
+  if invalid:
+    flash('Show could not be listed. ' + invalid)
+    return render_template('forms/new_show.html', form=ShowForm(request.form)), 400
+  if conflict:
+    flash('Show could not be listed. ' + conflict)
+    return render_template('forms/new_show.html', form=ShowForm(request.form)), 409
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Show could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#  Internal
+#  ----------------------------------------------------------------
+
+@app.route('/internal/cache')
+@internal_only
+def cache_stats():
+  return jsonify(page_cache.stats())
+
+def pool_metrics(engine):
+  if not isinstance(engine.pool, TimedQueuePool):
+    return {'pool': type(engine.pool).__name__}
+  return engine.pool.metrics()
+
+@app.route('/internal/pool')
+@internal_only
+def pool_stats():
+  return jsonify({
+    'primary': pool_metrics(db.engine),
+    'replicas': [pool_metrics(engine) for engine in db.replicas.engines],
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -541,6 +1270,618 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
+#----------------------------------------------------------------------------#
+# API.
+#----------------------------------------------------------------------------#
+
+# JSON API for venues, artists and shows. List endpoints stream every row as
+# a JSON array, or as NDJSON with ?format=ndjson (or Accept:
+# application/x-ndjson), reading the database in batches of
+# API_STREAM_BATCH_SIZE. ?fields=id,name selects only those columns in SQL.
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+SHOW_API_FIELDS = {
+  'id': Show.id,
+  'start_time': Show.start_time,
+  'end_time': Show.end_time,
+  'venue_id': Show.venue_id,
+  'venue_name': Venue.name,
+  'artist_id': Show.artist_id,
+  'artist_name': Artist.name,
+  'artist_image_link': Artist.image_link,
+}
+
+def entity_api_fields(model):
+  # Every column of the venue or artist table; num_upcoming_shows is kept as
+  # an alias of upcoming_shows_count.
+  fields = {column.key: getattr(model, column.key) for column in model.__table__.columns}
+  fields['num_upcoming_shows'] = model.upcoming_shows_count
+  return fields
+
+def requested_fields(available, default):
+  fields = request.args.get('fields')
+  if not fields:
+    return list(default)
+  names = [name.strip() for name in fields.split(',') if name.strip()]
+  unknown = [name for name in names if name not in available]
+  if unknown or not names:
+    abort(400, description='Unknown fields: ' + ', '.join(unknown))
+  return names
+
+def json_default(value):
+  if isinstance(value, (datetime.datetime, datetime.date)):
+    return value.isoformat()
+  raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def stream_rows(query, names):
+  # Streams query rows as JSON objects with the given keys, a batch of rows
+  # per chunk, without materializing the result.
+  ndjson = (request.args.get('format') == 'ndjson' or
+            request.accept_mimetypes.best == 'application/x-ndjson')
+  batch_size = app.config['API_STREAM_BATCH_SIZE']
+
+  def generate():
+    chunk = []
+    first = True
+    if not ndjson:
+      yield '['
+    for row in query.yield_per(batch_size):
+      record = json.dumps(dict(zip(names, row)), default=json_default)
+      if ndjson:
+        chunk.append(record + '\n')
+      else:
+        chunk.append(record if first else ',' + record)
+        first = False
+      if len(chunk) >= batch_size:
+        yield ''.join(chunk)
+        chunk = []
+    if not ndjson:
+      chunk.append(']')
+    yield ''.join(chunk)
+
+  mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+  return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def entity_query(model, fields, names):
+  return db.session.query(*[fields[name].label(name) for name in names]).select_from(model)
+
+def show_query(names, joins=()):
+  # Joins venue and artist only when one of their columns is selected or
+  # filtered on.
+  query = db.session.query(*[SHOW_API_FIELDS[name].label(name) for name in names]).select_from(Show)
+  return join_show_models(query, {SHOW_API_FIELDS[name].class_ for name in names} | set(joins))
+
+def entity_detail(model, entity_id, shows_for):
+  now = datetime.datetime.now()
+  fields = entity_api_fields(model)
+  available = list(fields) + ['past_shows', 'upcoming_shows']
+  names = requested_fields(available, available)
+  columns = [name for name in names if name in fields] or ['id']
+  row = entity_query(model, fields, columns).filter(model.id == entity_id).first()
+  if row is None:
+    abort(404, description=f'{model.__name__} {entity_id} does not exist')
+  record = {name: getattr(row, name) for name in columns if name in names}
+  if 'past_shows' in names or 'upcoming_shows' in names:
+    past_shows, upcoming_shows = split_shows(shows_for(entity_id), now)
+    if 'past_shows' in names:
+      record['past_shows'] = past_shows
+    if 'upcoming_shows' in names:
+      record['upcoming_shows'] = upcoming_shows
+  return Response(json.dumps(record, default=json_default), mimetype='application/json')
+
+@api.route('/venues')
+@reads_from_replica
+def list_venues():
+  # With lat and lng, the `limit` nearest venues or all those within radius
+  # km, closest first, each with its distance_km.
+  fields = entity_api_fields(Venue)
+  names = requested_fields(fields, ['id', 'name', 'city', 'state'])
+  query = entity_query(Venue, fields, names).filter(*genre_criteria(Venue.genres, request.args))
+  point = geo_point(request.args)
+  if point is not None:
+    return stream_rows(nearby(query, point, page_limit() if point[2] is None else None), names + ['distance_km'])
+  return stream_rows(query.order_by(Venue.id), names)
+
+@api.route('/venues/genres')
+@reads_from_replica
+def venue_genre_facets():
+  # Venues per genre for facet sidebars, narrowed by the listing's genre filters.
+  counts = genre_counts(Venue, genre_criteria(Venue.genres, request.args))
+  return jsonify({'genres': [{'genre': genre, 'count': count} for genre, count in counts]})
+
+@api.route('/venues/<int:venue_id>')
+@reads_from_replica
+def get_venue(venue_id):
+  return entity_detail(Venue, venue_id, venue_shows)
+
+@api.route('/artists')
+@reads_from_replica
+def list_artists():
+  fields = entity_api_fields(Artist)
+  names = requested_fields(fields, ['id', 'name', 'city', 'state'])
+  return stream_rows(entity_query(Artist, fields, names).filter(*genre_criteria(Artist.genres, request.args)).order_by(Artist.id), names)
+
+@api.route('/artists/genres')
+@reads_from_replica
+def artist_genre_facets():
+  # Artists per genre for facet sidebars, narrowed by the listing's genre filters.
+  counts = genre_counts(Artist, genre_criteria(Artist.genres, request.args))
+  return jsonify({'genres': [{'genre': genre, 'count': count} for genre, count in counts]})
+
+@api.route('/artists/<int:artist_id>')
+@reads_from_replica
+def get_artist(artist_id):
+  return entity_detail(Artist, artist_id, artist_shows)
+
+@api.route('/shows')
+@reads_from_replica
+def list_shows():
+  names = requested_fields(SHOW_API_FIELDS, SHOW_API_FIELDS)
+  criteria, joins = show_filters()
+  return stream_rows(show_query(names, joins).filter(*criteria).order_by(Show.start_time, Show.id), names)
+
+@api.route('/shows/calendar')
+@reads_from_replica
+def shows_calendar():
+  # Shows per day for calendar heatmaps, counted by the database. Takes the
+  # listing's filters; from and to are required and at most
+  # CALENDAR_MAX_DAYS apart.
+  if not (request.args.get('from') and request.args.get('to')):
+    abort(400, description='from and to are required')
+  start, end = local_datetime_arg('from'), local_datetime_arg('to')
+  if not datetime.timedelta(0) < end - start <= datetime.timedelta(days=app.config['CALENDAR_MAX_DAYS']):
+    abort(400, description=f'to must be after from and at most {app.config["CALENDAR_MAX_DAYS"]} days later')
+  criteria, joins = show_filters()
+  # A literal unit, so the select list and GROUP BY render the same expression.
+  day = db.func.date_trunc(db.literal_column("'day'"), Show.start_time).label('day')
+  query = join_show_models(db.session.query(day, db.func.count(Show.id).label('shows')).select_from(Show), joins)
+  rows = query.filter(*criteria).group_by(day).order_by(day).all()
+  record = {'from': start, 'to': end, 'days': [{'day': row.day.date().isoformat(), 'shows': row.shows} for row in rows]}
+  return Response(json.dumps(record, default=json_default), mimetype='application/json')
+
+@api.route('/shows/<int:show_id>')
+@reads_from_replica
+def get_show(show_id):
+  names = requested_fields(SHOW_API_FIELDS, SHOW_API_FIELDS)
+  row = show_query(names).filter(Show.id == show_id).first()
+  if row is None:
+    abort(404, description=f'Show {show_id} does not exist')
+  return Response(json.dumps(row._asdict(), default=json_default), mimetype='application/json')
+
+def availability(model, fk_column, entity_id):
+  # Whether a venue or artist is free for all of [start, end), and the shows
+  # in the way if not.
+  if db.session.query(model.id).filter(model.id == entity_id).first() is None:
+    abort(404, description=f'{model.__name__} {entity_id} does not exist')
+  start, end = local_datetime_arg('start'), local_datetime_arg('end')
+  if end <= start:
+    abort(400, description='end must be after start')
+  conflicts = booking_conflicts(fk_column, entity_id, start, end).with_entities(
+    Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time
+  ).limit(page_limit()).all()
+  record = {'start': start, 'end': end, 'available': not conflicts, 'conflicts': [row._asdict() for row in conflicts]}
+  return Response(json.dumps(record, default=json_default), mimetype='application/json')
+
+@api.route('/venues/<int:venue_id>/availability')
+@reads_from_replica
+def venue_availability(venue_id):
+  return availability(Venue, Show.venue_id, venue_id)
+
+@api.route('/artists/<int:artist_id>/availability')
+@reads_from_replica
+def artist_availability(artist_id):
+  return availability(Artist, Show.artist_id, artist_id)
+
+def recommendations(model, entity_id, seeking, kind, other_model, not_seeking):
+  # The best matches of the other side for a seeking venue or artist, with
+  # their scores.
+  entity = db.session.query(model.id, model.genres, model.city, model.state, seeking.label('seeking')).filter(
+    model.id == entity_id).first()
+  if entity is None:
+    abort(404, description=f'{model.__name__} {entity_id} does not exist')
+  if not entity.seeking:
+    abort(404, description=f'{model.__name__} {entity_id} {not_seeking}')
+  matches = matchmaker.recommend(kind, entity_id, entity.genres, entity.city, entity.state,
+                                 request.args.get('limit', type=int))
+  rows = {row.id: row for row in db.session.query(
+    other_model.id, other_model.name, other_model.city, other_model.state, other_model.genres
+  ).filter(other_model.id.in_([other_id for _, other_id in matches]))}
+  return jsonify({'data': [dict(rows[other_id]._asdict(), score=round(score, 4))
+                           for score, other_id in matches if other_id in rows]})
+
+@api.route('/venues/<int:venue_id>/recommended-artists')
+@reads_from_replica
+def recommended_artists(venue_id):
+  return recommendations(Venue, venue_id, Venue.seeking_talent, 'venue', Artist, 'is not seeking talent')
+
+@api.route('/artists/<int:artist_id>/recommended-venues')
+@reads_from_replica
+def recommended_venues(artist_id):
+  return recommendations(Artist, artist_id, Artist.seeking_venue, 'artist', Venue, 'is not seeking a venue')
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+  return jsonify({'error': error.description}), error.code
+
+app.register_blueprint(api)
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+IMPORT_FORMS = {'venues': (Venue, VenueForm), 'artists': (Artist, ArtistForm), 'shows': (Show, ShowForm)}
+
+def read_records(file, format):
+  # Yields raw records one at a time from a CSV or NDJSON file. In CSV the
+  # genres column holds a comma separated list.
+  if format == 'csv':
+    for record in csv.DictReader(file):
+      if record.get('genres') is not None:
+        record['genres'] = [genre.strip() for genre in record['genres'].split(',') if genre.strip()]
+      yield record
+  else:
+    for line in file:
+      if line.strip():
+        yield json.loads(line)
+
+def validate_record(model, form_class, record):
+  # Runs the record through the same form the site uses. Returns
+  # (column values, None) or (None, {field: [errors]}).
+  # Date-times in any format dateutil reads, such as the ISO 8601 of the API
+  # and `flask export`, are rewritten in the form's format first; values it
+  # cannot read are left for the form to reject.
+  formdata = MultiDict()
+  for key, value in record.items():
+    if isinstance(value, list):
+      formdata.setlist(key, [str(v) for v in value])
+    elif value is not None:
+      formdata[key] = str(value)
+      field = getattr(form_class, key, None)
+      if issubclass(getattr(field, 'field_class', type(None)), DateTimeField) and value != '':
+        try:
+          formdata[key] = local_datetime(str(value)).strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, OverflowError):
+          pass
+  form = form_class(formdata=formdata, meta={'csrf': False})
+  if not form.validate():
+    return None, form.errors
+  values = {key: value for key, value in form.data.items() if key in model.__table__.columns}
+  if model is Show:
+    try:
+      values['artist_id'] = int(values['artist_id'])
+      values['venue_id'] = int(values['venue_id'])
+    except ValueError:
+      return None, {'id': ['artist_id and venue_id must be integers']}
+    values['end_time'] = show_end_time(values['start_time'], values['end_time'], form.duration.data)
+    if values['end_time'] <= values['start_time']:
+      return None, {'end_time': ['end_time must be after start_time']}
+  return values, None
+
+def copy_literal(value):
+  # Encodes a value for COPY ... (FORMAT csv) with QUOTE_NONNUMERIC, which
+  # keeps NULL (unquoted empty) distinct from the empty string.
+  if isinstance(value, bool):
+    return 't' if value else 'f'
+  if isinstance(value, list):
+    return '{' + ','.join('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value) + '}'
+  if isinstance(value, datetime.datetime):
+    return value.isoformat(sep=' ')
+  return value
+
+def copy_rows(model, columns, rows):
+  # Bulk loads rows with PostgreSQL COPY inside the session's transaction.
+  buffer = io.StringIO()
+  writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+  for row in rows:
+    writer.writerow([copy_literal(row[column]) for column in columns])
+  buffer.seek(0)
+  cursor = db.session.connection().connection.cursor()
+  cursor.copy_expert(f'COPY {model.__tablename__} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+def write_batch(model, batch, rejected):
+  # Writes (line, values) pairs in one COPY. If the database refuses the
+  # batch (e.g. a show referencing a missing venue), falls back to inserting
+  # row by row under savepoints so that only the offending rows are rejected.
+  columns = list(batch[0][1])
+  try:
+    copy_rows(model, columns, [values for _, values in batch])
+    written = [values for _, values in batch]
+  except Exception:
+    db.session.rollback()
+    written = []
+    for line, values in batch:
+      try:
+        with db.session.begin_nested():
+          db.session.execute(model.__table__.insert(), values)
+        written.append(values)
+      except Exception as e:
+        rejected(line, {'database': [str(getattr(e, 'orig', e)).strip()]}, values)
+  if model is Show:
+    adjust_upcoming_show_counts([(v['venue_id'], v['artist_id'], v['start_time']) for v in written], 1)
+  db.session.commit()
+  if model is Show:
+    page_cache.invalidate({('venue', v['venue_id']) for v in written} | {('artist', v['artist_id']) for v in written})
+  return len(written)
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORT_FORMS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per COPY and commit.')
+@click.option('--offset', default=0, help='Skip this many records, to resume after a failure.')
+@click.option('--rejects', type=click.Path(dir_okay=False), help='NDJSON report of rejected rows. Defaults to PATH.rejects.ndjson.')
+def import_command(kind, path, format, batch_size, offset, rejects):
+  """Bulk import venues, artists or shows from a CSV or NDJSON file."""
+  model, form_class = IMPORT_FORMS[kind]
+  if format is None:
+    format = 'csv' if path.endswith('.csv') else 'ndjson'
+  rejects = rejects or path + '.rejects.ndjson'
+  counts = {'written': 0, 'rejected': 0}
+
+  with open(path, newline='') as file, open(rejects, 'a' if offset else 'w') as report, app.test_request_context():
+    def rejected(line, errors, record):
+      counts['rejected'] += 1
+      report.write(json.dumps({'record': line, 'errors': errors, 'data': record}, default=json_default) + '\n')
+
+    batch = []
+    position = offset
+    for position, record in enumerate(read_records(file, format), start=1):
+      if position <= offset:
+        continue
+      values, errors = validate_record(model, form_class, record)
+      if errors:
+        rejected(position, errors, record)
+      else:
+        batch.append((position, values))
+      if len(batch) >= batch_size:
+        counts['written'] += write_batch(model, batch, rejected)
+        batch = []
+        click.echo(f'{counts["written"]} written, {counts["rejected"]} rejected; resume with --offset {position}')
+    if batch:
+      counts['written'] += write_batch(model, batch, rejected)
+  if model is Venue:
+    geocoded = geocode_venues()
+    db.session.commit()
+    click.echo(f'Geocoded {geocoded} venues.')
+
+  click.echo(f'Done: {counts["written"]} written, {counts["rejected"]} rejected (see {rejects}); {position} records read.')
+
+
+EXPORT_MODELS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+def export_batches(query, batch_size):
+  # Reads through a server-side cursor, batch_size rows per round trip.
+  batch = []
+  for row in query.yield_per(batch_size).execution_options(stream_results=True):
+    batch.append(row)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def arrow_schema(columns):
+  import pyarrow
+  types = []
+  for column in columns:
+    if isinstance(column.type, db.ARRAY):
+      types.append(pyarrow.list_(pyarrow.string()))
+    elif isinstance(column.type, db.Boolean):
+      types.append(pyarrow.bool_())
+    elif isinstance(column.type, db.Integer):
+      types.append(pyarrow.int64())
+    elif isinstance(column.type, db.Float):
+      types.append(pyarrow.float64())
+    elif isinstance(column.type, db.DateTime):
+      types.append(pyarrow.timestamp('us'))
+    elif isinstance(column.type, db.String):
+      types.append(pyarrow.string())
+    else:
+      raise TypeError(f'No Parquet type for {column.key} ({column.type})')
+  return pyarrow.schema([(column.key, type) for column, type in zip(columns, types)])
+
+def write_parquet(path, columns, batches, compress):
+  # One Parquet row group per batch, so memory stays bounded by batch size.
+  try:
+    import pyarrow
+    import pyarrow.parquet
+  except ImportError:
+    raise click.ClickException('Parquet export requires the pyarrow package.')
+  schema = arrow_schema(columns)
+  count = 0
+  with pyarrow.parquet.ParquetWriter(path, schema, compression='gzip' if compress else 'snappy') as writer:
+    for batch in batches:
+      arrays = [pyarrow.array([row[i] for row in batch], type=schema.field(i).type) for i in range(len(columns))]
+      writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+      count += len(batch)
+      yield count
+
+def csv_value(value):
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  if isinstance(value, list):
+    return ','.join(value)
+  if isinstance(value, datetime.datetime):
+    return value.isoformat(sep=' ')
+  return value
+
+def write_text(path, format, columns, batches, compress):
+  # CSV (genres as a comma separated list, as flask import reads them) or NDJSON.
+  names = [column.key for column in columns]
+  opener = gzip.open if compress else open
+  count = 0
+  with opener(path, 'wt', newline='') as file:
+    if format == 'csv':
+      writer = csv.writer(file)
+      writer.writerow(names)
+    for batch in batches:
+      for row in batch:
+        if format == 'csv':
+          writer.writerow([csv_value(value) for value in row])
+        else:
+          file.write(json.dumps(dict(zip(names, row)), default=json_default) + '\n')
+      count += len(batch)
+      yield count
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(list(EXPORT_MODELS)))
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson', 'parquet']), default='ndjson', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output (Parquet uses gzip column compression).')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows fetched per round trip.')
+@click.option('--since', type=click.DateTime(), help='Export only rows updated at or after this time.')
+@click.option('--state', type=click.Path(dir_okay=False), help='JSON file recording the last snapshot; exports only rows changed or deleted since then and updates it.')
+def export_command(kind, path, format, compress, batch_size, since, state):
+  """Stream venues, artists or shows to a CSV, NDJSON or Parquet snapshot.
+
+  Incremental snapshots overlap by EXPORT_OVERLAP_SECONDS and may repeat
+  rows; apply them as upserts by id. They have an extra `deleted` column:
+  rows deleted since (id and updated_at only) have it true; delete them."""
+  # The next snapshot starts EXPORT_OVERLAP_SECONDS before this one did,
+  # not at the newest updated_at seen: a transaction still open now (an
+  # import batch, a request) can commit rows stamped earlier than that, and
+  # app servers' clocks may differ. Re-exported rows are identical, so the
+  # overlap is harmless to consumers upserting by id.
+  started = datetime.datetime.now()
+  model = EXPORT_MODELS[kind]
+  columns = list(model.__table__.columns)
+  snapshots = {}
+  if state and os.path.exists(state):
+    with open(state) as file:
+      snapshots = json.load(file)
+    if since is None and kind in snapshots:
+      since = datetime.datetime.fromisoformat(snapshots[kind])
+
+  if since is not None:
+    query = db.session.query(*columns, db.literal(False).label('deleted')).filter(
+      model.updated_at >= since).order_by(model.updated_at, model.id)
+    tombstones = db.session.query(Deletion.record_id, Deletion.deleted_at).filter(
+      Deletion.kind == model.__tablename__, Deletion.deleted_at >= since).order_by(Deletion.deleted_at, Deletion.id)
+    def tombstone(row):
+      return tuple(row.record_id if column.key == 'id' else row.deleted_at if column.key == 'updated_at' else None
+                   for column in model.__table__.columns) + (True,)
+    batches = itertools.chain(
+      export_batches(query, batch_size),
+      ([tombstone(row) for row in batch] for batch in export_batches(tombstones, batch_size)))
+    columns = columns + [db.Column('deleted', db.Boolean)]
+  else:
+    batches = export_batches(db.session.query(*columns).order_by(model.id), batch_size)
+
+  if format == 'parquet':
+    progress = write_parquet(path, columns, batches, compress)
+  else:
+    progress = write_text(path, format, columns, batches, compress)
+  count = 0
+  for count in progress:
+    click.echo(f'{count} {kind} exported', err=True)
+
+  if state:
+    next_since = started - datetime.timedelta(seconds=app.config['EXPORT_OVERLAP_SECONDS'])
+    snapshots[kind] = max(next_since, since).isoformat() if since else next_since.isoformat()
+    with open(state, 'w') as file:
+      json.dump(snapshots, file, indent=2)
+  click.echo(f'Done: {count} {kind} written to {path}' + (f' (changed since {since})' if since else ''))
+
+
+@app.cli.command('roll-shows')
+@click.option('--window-minutes', default=120, show_default=True,
+              help='Recount venues and artists with shows that started this recently. Keep it above the run interval.')
+def roll_shows_command(window_minutes):
+  """Move shows that have started from upcoming to past counts. Run periodically, e.g. from cron every 15 minutes."""
+  now = datetime.datetime.now()
+  started = db.session.query(Show.venue_id, Show.artist_id).filter(
+    Show.start_time > now - datetime.timedelta(minutes=window_minutes),
+    Show.start_time <= now
+  ).all()
+  venues = recount_upcoming_shows(Venue, now, {show.venue_id for show in started}) if started else 0
+  artists = recount_upcoming_shows(Artist, now, {show.artist_id for show in started}) if started else 0
+  db.session.commit()
+  click.echo(f'{len(started)} shows started; updated {venues} venues and {artists} artists.')
+
+@app.cli.command('recount')
+@click.option('--check', is_flag=True, help='Only report drift; exit with status 1 if any count is wrong.')
+@click.option('--window-minutes', default=120, show_default=True,
+              help='With --check, accept counts still including shows that started this recently, '
+                   'which `flask roll-shows` has not moved yet. Match the roll-shows window.')
+def recount_command(check, window_minutes):
+  """Recompute every upcoming_shows_count from the show table, repairing drift."""
+  now = datetime.datetime.now()
+  drift = {}
+  for name, model in (('venues', Venue), ('artists', Artist)):
+    if check:
+      # Between the roll-shows runs a count may lag by the shows that have
+      # started since, so anything from the live count up to the count as of
+      # the window's start is consistent.
+      rolled_since = now - datetime.timedelta(minutes=window_minutes)
+      drift[name] = model.query.filter(db.or_(
+        model.upcoming_shows_count < upcoming_shows_count_subquery(model, now),
+        model.upcoming_shows_count > upcoming_shows_count_subquery(model, rolled_since),
+      )).count()
+    else:
+      drift[name] = recount_upcoming_shows(model, now)
+  if check:
+    db.session.rollback()
+    click.echo(f'{drift["venues"]} venues and {drift["artists"]} artists have a wrong upcoming_shows_count.')
+    if any(drift.values()):
+      sys.exit(1)
+  else:
+    db.session.commit()
+    click.echo(f'Repaired {drift["venues"]} venues and {drift["artists"]} artists.')
+
+@app.cli.group('geocode')
+def geocode_group():
+  """Offline geocoding of venues from the geocode gazetteer table."""
+
+@geocode_group.command('load')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per statement and commit.')
+def geocode_load_command(path, batch_size):
+  """Load city centres from a CSV with city, state, latitude and longitude columns.
+
+  Rows replace any existing entry for the same city and state."""
+  statement = pg_insert(Geocode.__table__)
+  statement = statement.on_conflict_do_update(
+    index_elements=['city', 'state'],
+    set_={name: statement.excluded[name] for name in ('latitude', 'longitude', 'geo_cell')})
+  loaded = skipped = 0
+  batch = []
+  with open(path, newline='') as file:
+    for line, record in enumerate(csv.DictReader(file), start=2):
+      try:
+        city, state = record['city'].strip().lower(), record['state'].strip()
+        latitude, longitude = float(record['latitude']), float(record['longitude'])
+        if not city or not state or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+          raise ValueError(record)
+      except (KeyError, TypeError, ValueError, AttributeError):
+        skipped += 1
+        click.echo(f'Skipping line {line}: {record}', err=True)
+        continue
+      batch.append({'city': city, 'state': state, 'latitude': latitude, 'longitude': longitude,
+                    'geo_cell': geo.cell(latitude, longitude)})
+      if len(batch) >= batch_size:
+        db.session.execute(statement, batch)
+        db.session.commit()
+        loaded += len(batch)
+        batch = []
+  if batch:
+    db.session.execute(statement, batch)
+    db.session.commit()
+    loaded += len(batch)
+  click.echo(f'Loaded {loaded} places, skipped {skipped}. Run `flask geocode venues --all` to apply changed entries.')
+
+@geocode_group.command('venues')
+@click.option('--all', 'everything', is_flag=True, help='Also recompute venues that already have coordinates.')
+def geocode_venues_command(everything):
+  """Fill in venue coordinates from the gazetteer."""
+  updated = geocode_venues(everything)
+  db.session.commit()
+  missing = Venue.query.filter(Venue.latitude.is_(None)).count()
+  click.echo(f'Geocoded {updated} venues; {missing} have no gazetteer entry for their city.')
+
+
 if not app.debug:
     file_handler = FileHandler('error.log')
     file_handler.setFormatter(
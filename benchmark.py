@@ -0,0 +1,559 @@
+#----------------------------------------------------------------------------#
+# Benchmarks.
+#
+# Run against a scratch database, never the one configured for the site:
+#   BENCHMARK_DATABASE_URI=postgres://postgres@localhost:5432/fyyur_bench \
+#     python benchmark.py search --rows 100000
+#     python benchmark.py explain
+#     python benchmark.py datetime-filter
+#     python benchmark.py routes --baseline benchmark_baseline.json
+#----------------------------------------------------------------------------#
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import babel.dates
+import dateutil.parser
+
+from app import (app, db, Venue, Artist, Show, DATETIME_FORMATS, format_datetime, format_datetime_cached,
+                 copy_rows, recount_upcoming_shows)
+import geo
+
+WORDS = ['The', 'Musical', 'Hop', 'Park', 'Square', 'Live', 'Music', 'Coffee',
+         'Dueling', 'Pianos', 'Bar', 'Guns', 'Petals', 'Wild', 'Sax', 'Band',
+         'Blue', 'Note', 'Hall', 'Room', 'Cellar', 'Garden', 'Lounge', 'Club']
+
+SEARCH_TERMS = ['a', 'hop', 'music', 'sax band', 'cellar', 'zzz']
+
+def use_benchmark_database():
+  uri = os.environ.get('BENCHMARK_DATABASE_URI')
+  if not uri:
+    sys.exit('Set BENCHMARK_DATABASE_URI to a scratch database before running benchmarks.')
+  app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+def random_name(rng):
+  return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))) + ' ' + str(rng.randint(1, 99999))
+
+def reset_schema():
+  db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+  db.session.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+  db.session.commit()
+  db.drop_all()
+  db.create_all()
+
+def seed_names(rows, batch_size=10000, seed=0):
+  # Recreates the schema and bulk inserts `rows` venues and artists.
+  rng = random.Random(seed)
+  reset_schema()
+  for model, extra in ((Venue, {'address': '1 Main St', 'seeking_talent': False}),
+                       (Artist, {'seeking_venue': False})):
+    for start in range(0, rows, batch_size):
+      batch = [dict(name=random_name(rng), city='San Francisco', state='CA', genres=['Jazz'], **extra)
+               for _ in range(min(batch_size, rows - start))]
+      db.session.execute(model.__table__.insert(), batch)
+    db.session.commit()
+  db.session.execute('ANALYZE')
+  db.session.commit()
+
+def time_query(statement, params, repeat, sequential_scan=False):
+  # Returns per-run wall times in milliseconds. With sequential_scan the
+  # planner is forbidden from using indexes, which is what ILIKE costs
+  # without the pg_trgm index.
+  timings = []
+  for _ in range(repeat):
+    if sequential_scan:
+      db.session.execute('SET LOCAL enable_bitmapscan = off')
+      db.session.execute('SET LOCAL enable_indexscan = off')
+    start = time.perf_counter()
+    db.session.execute(statement, params).fetchall()
+    timings.append((time.perf_counter() - start) * 1000)
+    db.session.rollback()
+  return timings
+
+def report(label, timings):
+  timings = sorted(timings)
+  p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+  print(f'  {label:<28} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms')
+
+def bench_search(args):
+  use_benchmark_database()
+  with app.app_context():
+    if not args.no_seed:
+      print(f'Seeding {args.rows} venues and artists...')
+      seed_names(args.rows)
+    for table in ('venue', 'artist'):
+      statement = (f"SELECT id, name FROM {table} WHERE name ILIKE :pattern "
+                   f"ORDER BY similarity(name, :term) DESC, name, id LIMIT :limit")
+      for term in SEARCH_TERMS:
+        params = {'pattern': '%' + term + '%', 'term': term, 'limit': app.config['SEARCH_RESULT_LIMIT']}
+        print(f'{table} "{term}"')
+        report('ILIKE, sequential scan', time_query(statement, params, args.repeat, sequential_scan=True))
+        report('ILIKE, pg_trgm GIN index', time_query(statement, params, args.repeat))
+
+def capture_statements(path):
+  # Returns the (statement, parameters) pairs a GET of `path` sends to the database.
+  statements = []
+  def capture(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+  event.listen(Engine, 'before_cursor_execute', capture)
+  try:
+    response = app.test_client().get(path)
+  finally:
+    event.remove(Engine, 'before_cursor_execute', capture)
+  if response.status_code != 200:
+    sys.exit(f'GET {path} returned {response.status_code}')
+  return statements
+
+# Statements reading the show table.
+SHOW_TABLE = re.compile(r'\b(FROM|JOIN) show\b')
+
+def seeks_index(plan, index, column):
+  # Whether a node of an EXPLAIN plan scans `index` with an Index Cond on
+  # `column`, rather than reading all of it or some other index.
+  lines = plan.splitlines()
+  for i, line in enumerate(lines):
+    if index in line:
+      for detail in lines[i + 1:]:
+        if '->' in detail:
+          break
+        if 'Index Cond' in detail and column in detail:
+          return True
+  return False
+
+def bench_explain(args):
+  # EXPLAINs every statement reading `show` issued by the venue and artist
+  # detail pages and fails unless each seeks the page's own index:
+  # ix_show_venue_id_start_time on venue_id, ix_show_artist_id_start_time on
+  # artist_id. Any index would do to avoid a sequential scan (a full pass
+  # over ix_show_start_time_id, the GiST exclusion indexes), so the check
+  # names the index. Sequential scans are disabled for the session so that,
+  # even on a small dataset, the planner shows which index it would use.
+  use_benchmark_database()
+  with app.app_context():
+    venue = Venue.query.with_entities(Venue.id).first()
+    artist = Artist.query.with_entities(Artist.id).first()
+    if venue is None or artist is None:
+      sys.exit('Seed the benchmark database first (e.g. benchmark.py search).')
+    paths = [(f'/venues/{venue.id}', 'ix_show_venue_id_start_time', 'venue_id'),
+             (f'/artists/{artist.id}', 'ix_show_artist_id_start_time', 'artist_id')]
+    failures = 0
+    connection = db.engine.raw_connection()
+    try:
+      cursor = connection.cursor()
+      cursor.execute('SET enable_seqscan = off')
+      for path, index, column in paths:
+        statements = [(s, p) for s, p in capture_statements(path) if SHOW_TABLE.search(s)]
+        if not statements:
+          failures += 1
+          print(f'FAIL {path}: no statement read the show table (served from the page cache?)\n')
+        for statement, parameters in statements:
+          cursor.execute('EXPLAIN ' + statement, parameters)
+          plan = '\n'.join(row[0] for row in cursor.fetchall())
+          ok = 'Seq Scan on show' not in plan and seeks_index(plan, index, column)
+          failures += not ok
+          print(f"{'ok  ' if ok else 'FAIL'} {path} (expects {index} on {column})\n{plan}\n")
+    finally:
+      connection.close()
+  if failures:
+    sys.exit(f'{failures} detail page queries do not seek their show index')
+
+def bench_datetime_filter(args):
+  # Renders the start time of `shows` shows with the original
+  # stringify/reparse/format path and with the current filter.
+  rng = random.Random(0)
+  base = datetime.datetime(2020, 1, 1, 18)
+  # Shows start on the hour or half hour, so start times repeat.
+  start_times = [base + datetime.timedelta(minutes=30 * rng.randrange(args.distinct))
+                 for _ in range(args.shows)]
+  locale = app.config['DATETIME_LOCALE']
+
+  def original():
+    for start_time in start_times:
+      babel.dates.format_datetime(dateutil.parser.parse(str(start_time)), DATETIME_FORMATS['full'], locale=locale)
+
+  def current():
+    format_datetime_cached.cache_clear()
+    for start_time in start_times:
+      format_datetime(start_time, 'full')
+
+  print(f'{args.shows} shows, {args.distinct} distinct start times')
+  for label, func in (('str + dateutil + babel', original), ('datetime filter', current)):
+    timings = []
+    for _ in range(args.repeat):
+      start = time.perf_counter()
+      func()
+      timings.append((time.perf_counter() - start) * 1000)
+    report(label, timings)
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+          'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+          'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other']
+# (city, state, latitude, longitude) of the city centre.
+CITIES = [('San Francisco', 'CA', 37.7749, -122.4194), ('New York', 'NY', 40.7128, -74.0060),
+          ('Austin', 'TX', 30.2672, -97.7431), ('Chicago', 'IL', 41.8781, -87.6298),
+          ('Seattle', 'WA', 47.6062, -122.3321), ('Nashville', 'TN', 36.1627, -86.7816),
+          ('New Orleans', 'LA', 29.9511, -90.0715), ('Denver', 'CO', 39.7392, -104.9903)]
+
+def seed_catalog(venues, artists, shows, batch_size=10000, seed=0):
+  # Recreates the schema and COPYs in a synthetic catalog: two hour shows
+  # starting on the hour within a year either side of now, with no venue or
+  # artist double booked. The upcoming show counts are then recomputed as
+  # `flask recount` would.
+  if venues > artists:
+    sys.exit('Seeding needs at least as many artists as venues.')
+  rng = random.Random(seed)
+  reset_schema()
+  now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+
+  # Venues are scattered up to about 30 km around their city centre.
+  def venue(i):
+    city, state, latitude, longitude = rng.choice(CITIES)
+    latitude, longitude = latitude + rng.uniform(-0.27, 0.27), longitude + rng.uniform(-0.35, 0.35)
+    return dict(name=random_name(rng), city=city, state=state, address=f'{i} Main St',
+                phone='555-555-5555', genres=rng.sample(GENRES, rng.randint(1, 3)),
+                seeking_talent=rng.random() < 0.3, seeking_description='',
+                latitude=latitude, longitude=longitude, geo_cell=geo.cell(latitude, longitude))
+
+  def artist(i):
+    city, state, _, _ = rng.choice(CITIES)
+    return dict(name=random_name(rng), city=city, state=state, phone='555-555-5555',
+                genres=rng.sample(GENRES, rng.randint(1, 3)), seeking_venue=rng.random() < 0.3,
+                seeking_description='')
+
+  # Round i // venues gives every venue one show, each with a different
+  # artist, inside a window of its own.
+  rounds = -(-shows // venues)
+  step = max(3, 2 * 365 * 24 // rounds)
+  round_offsets = [rng.randrange(artists) for _ in range(rounds)]
+
+  def show(i):
+    slot, venue_index = divmod(i, venues)
+    start_time = now - datetime.timedelta(days=365) + datetime.timedelta(hours=slot * step + rng.randint(0, step - 3))
+    return dict(venue_id=venue_index + 1, artist_id=(venue_index + round_offsets[slot]) % artists + 1,
+                start_time=start_time, end_time=start_time + datetime.timedelta(hours=2))
+
+  for model, rows, make in ((Venue, venues, venue), (Artist, artists, artist), (Show, shows, show)):
+    for start in range(0, rows, batch_size):
+      batch = [make(i) for i in range(start, min(rows, start + batch_size))]
+      copy_rows(model, list(batch[0]), batch)
+      db.session.commit()
+    print(f'  {rows} {model.__tablename__} rows')
+  recount_upcoming_shows(Venue, datetime.datetime.now())
+  recount_upcoming_shows(Artist, datetime.datetime.now())
+  db.session.commit()
+  db.session.execute('ANALYZE')
+  db.session.commit()
+
+# Every read route in app.py: (label, method, path, form). Paths are filled
+# in per request with random ids from the seeded catalog, a random search
+# term and genre, a random three hours or month within the seeded year
+# either side of now, and a random point near one of the seeded cities (or
+# that city). Routes that write (create, edit, delete) are left out so runs
+# stay comparable, as are the full-table /api/v1/shows export and the
+# /internal and /metrics endpoints.
+ROUTES = [
+  ('index', 'GET', '/', None),
+  ('venues', 'GET', '/venues', None),
+  ('venues_nearest', 'GET', '/venues?lat={lat}&lng={lng}', None),
+  ('venues_within', 'GET', '/venues?lat={lat}&lng={lng}&radius=10', None),
+  ('venues_genre', 'GET', '/venues?genre={genre}', None),
+  ('show_venue', 'GET', '/venues/{venue}', None),
+  ('search_venues', 'POST', '/venues/search', {'search_term': '{term}'}),
+  ('search_venues_nearest', 'POST', '/venues/search', {'search_term': '{term}', 'lat': '{lat}', 'lng': '{lng}'}),
+  ('typeahead_venues', 'GET', '/venues/typeahead?q={term}', None),
+  ('create_venue_form', 'GET', '/venues/create', None),
+  ('edit_venue', 'GET', '/venues/{venue}/edit', None),
+  ('artists', 'GET', '/artists', None),
+  ('artists_genre', 'GET', '/artists?genre={genre}', None),
+  ('show_artist', 'GET', '/artists/{artist}', None),
+  ('search_artists', 'POST', '/artists/search', {'search_term': '{term}'}),
+  ('typeahead_artists', 'GET', '/artists/typeahead?q={term}', None),
+  ('create_artist_form', 'GET', '/artists/create', None),
+  ('edit_artist', 'GET', '/artists/{artist}/edit', None),
+  ('shows', 'GET', '/shows', None),
+  ('shows_filtered', 'GET', '/shows?from={start}&to={month_end}&city={city}&genre={genre}', None),
+  ('create_shows', 'GET', '/shows/create', None),
+  ('api.list_venues', 'GET', '/api/v1/venues', None),
+  ('api.list_venues_within', 'GET', '/api/v1/venues?lat={lat}&lng={lng}&radius=5', None),
+  ('api.venue_availability', 'GET', '/api/v1/venues/{venue}/availability?start={start}&end={end}', None),
+  ('api.venue_genre_facets', 'GET', '/api/v1/venues/genres', None),
+  ('api.venue_genre_facets_filtered', 'GET', '/api/v1/venues/genres?genre={genre}', None),
+  ('api.get_venue', 'GET', '/api/v1/venues/{venue}', None),
+  ('api.list_artists', 'GET', '/api/v1/artists', None),
+  ('api.artist_availability', 'GET', '/api/v1/artists/{artist}/availability?start={start}&end={end}', None),
+  ('api.artist_genre_facets', 'GET', '/api/v1/artists/genres', None),
+  ('api.artist_genre_facets_filtered', 'GET', '/api/v1/artists/genres?genre={genre}', None),
+  ('api.get_artist', 'GET', '/api/v1/artists/{artist}', None),
+  ('api.get_show', 'GET', '/api/v1/shows/{show}', None),
+  ('api.recommended_artists', 'GET', '/api/v1/venues/{seeking_venue}/recommended-artists', None),
+  ('api.recommended_venues', 'GET', '/api/v1/artists/{seeking_artist}/recommended-venues', None),
+  ('api.shows_calendar', 'GET', '/api/v1/shows/calendar?from={start}&to={month_end}&state={state}&genre={genre}', None),
+]
+
+# Statements per request allowed on the pages that once issued queries per
+# row, whatever the baseline says. The counts do not depend on
+# page size or catalog size, so a per-row pattern coming back fails here.
+QUERY_BUDGETS = {
+  'venues': 2,
+  'venues_within': 2,
+  'venues_genre': 2,
+  'artists': 2,
+  'artists_genre': 2,
+  'shows': 2,
+  'shows_filtered': 2,
+  'api.shows_calendar': 1,
+  'api.venue_genre_facets': 1,
+  'api.venue_genre_facets_filtered': 1,
+  'api.artist_genre_facets': 1,
+  'api.artist_genre_facets_filtered': 1,
+  'api.venue_availability': 2,
+  'api.artist_availability': 2,
+  'show_venue': 4,
+  'show_artist': 4,
+  'search_venues': 2,
+  'search_artists': 2,
+}
+
+def check_query_budgets(results):
+  return [f'{label}: {result["queries"]} queries > budget {QUERY_BUDGETS[label]}'
+          for label, result in results.items()
+          if label in QUERY_BUDGETS and result['queries'] is not None and result['queries'] > QUERY_BUDGETS[label]]
+
+class RouteDriver:
+  # Issues route requests through the Flask test client, or over HTTP when
+  # `url` is given, and returns (milliseconds, statements, status). The
+  # statement count is per thread, so it is only known in-process, as are
+  # the ids of venues and artists seeking matches (`seeking`); over HTTP
+  # any id is used and the recommendation routes may answer 404.
+
+  def __init__(self, counts, url=None, seed=0, seeking=None):
+    self.counts = counts
+    self.seeking = seeking or {}
+    self.url = url.rstrip('/') if url else None
+    self.rng = random.Random(seed)
+    self.now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    self.local = threading.local()
+    event.listen(Engine, 'before_cursor_execute', self.count)
+
+  def close(self):
+    event.remove(Engine, 'before_cursor_execute', self.count)
+
+  def count(self, conn, cursor, statement, parameters, context, executemany):
+    self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+  def fill(self, template):
+    city, state, latitude, longitude = self.rng.choice(CITIES)
+    # A month inside the seeded year either side of now.
+    start = self.now + datetime.timedelta(hours=self.rng.randrange(-365 * 24, (365 - 31) * 24))
+    return template.format(venue=self.rng.randint(1, self.counts['venue']),
+                           lat=round(latitude + self.rng.uniform(-0.2, 0.2), 4),
+                           lng=round(longitude + self.rng.uniform(-0.2, 0.2), 4),
+                           city=urllib.parse.quote(city), state=state,
+                           genre=urllib.parse.quote(self.rng.choice(GENRES)),
+                           start=start.isoformat(), end=(start + datetime.timedelta(hours=3)).isoformat(),
+                           month_end=(start + datetime.timedelta(days=31)).isoformat(),
+                           artist=self.rng.randint(1, self.counts['artist']),
+                           seeking_venue=self.seeking_id('venue'), seeking_artist=self.seeking_id('artist'),
+                           show=self.rng.randint(1, self.counts['show']),
+                           term=urllib.parse.quote(self.rng.choice(SEARCH_TERMS)))
+
+  def seeking_id(self, kind):
+    ids = self.seeking.get(kind)
+    return self.rng.choice(ids) if ids else self.rng.randint(1, self.counts[kind])
+
+  def request(self, route):
+    label, method, path, form = route
+    path = self.fill(path)
+    data = {key: urllib.parse.unquote(self.fill(value)) for key, value in form.items()} if form else None
+    self.local.queries = 0
+    start = time.perf_counter()
+    if self.url is None:
+      client = getattr(self.local, 'client', None) or app.test_client()
+      self.local.client = client
+      status = client.open(path, method=method, data=data, buffered=True).status_code
+    else:
+      body = urllib.parse.urlencode(data).encode() if data else None
+      try:
+        with urllib.request.urlopen(urllib.request.Request(self.url + path, data=body, method=method)) as response:
+          response.read()
+          status = response.status
+      except urllib.error.HTTPError as error:
+        status = error.code
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return elapsed_ms, None if self.url else self.local.queries, status
+
+def rss_mb():
+  # Current resident set size; peak RSS where /proc is unavailable.
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+  except OSError:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+def percentile(timings, q):
+  timings = sorted(timings)
+  return timings[min(len(timings) - 1, int(len(timings) * q))]
+
+def summarize(samples):
+  # samples: list of (milliseconds, statements, status) for one route.
+  timings = [sample[0] for sample in samples]
+  queries = [sample[1] for sample in samples if sample[1] is not None]
+  return {
+    'requests': len(samples),
+    'errors': sum(1 for sample in samples if sample[2] >= 500),
+    'p50_ms': round(percentile(timings, 0.50), 2),
+    'p95_ms': round(percentile(timings, 0.95), 2),
+    'p99_ms': round(percentile(timings, 0.99), 2),
+    'queries': max(queries) if queries else None,
+  }
+
+def print_results(title, results):
+  print(title)
+  print(f'  {"route":<20} {"reqs":>6} {"errors":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>7} {"rss MB":>8}')
+  for label, result in results.items():
+    queries = '-' if result['queries'] is None else result['queries']
+    rss = f'{result["rss_mb"]:.0f}' if 'rss_mb' in result else '-'
+    print(f'  {label:<20} {result["requests"]:>6} {result["errors"]:>6} {result["p50_ms"]:>9.2f} '
+          f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {queries:>7} {rss:>8}')
+
+def compare_baseline(results, baseline, tolerance):
+  # A route regresses when its p95 grows by more than `tolerance` or it
+  # issues more statements per request than the baseline recorded.
+  # Latency depends on the machine and its load, so these are reported but
+  # never fail the run; QUERY_BUDGETS is the gate.
+  regressions = []
+  for label, expected in baseline.items():
+    result = results.get(label)
+    if result is None:
+      continue
+    if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+      regressions.append(f'{label}: p95 {result["p95_ms"]:.2f} ms > baseline {expected["p95_ms"]:.2f} ms (+{tolerance:.0%})')
+    if expected.get('queries') is not None and result['queries'] is not None and result['queries'] > expected['queries']:
+      regressions.append(f'{label}: {result["queries"]} queries > baseline {expected["queries"]}')
+  return regressions
+
+def check_errors(results):
+  return [f'{label}: {result["errors"]} server errors' for label, result in results.items() if result['errors']]
+
+def bench_routes(args):
+  # A sequential pass over every route (latency, statements per request and
+  # RSS after each route), then a concurrent load pass over a random mix.
+  if args.url is None:
+    use_benchmark_database()
+  # Production behaviour: no debug-mode query guard or template reloading.
+  app.debug = False
+  with app.app_context():
+    if args.url is None and (args.reseed or not db.session.query(Venue.id).first()):
+      print(f'Seeding {args.venues} venues, {args.artists} artists, {args.shows} shows...')
+      seed_catalog(args.venues, args.artists, args.shows)
+    if args.url is None:
+      counts = {'venue': Venue.query.count(), 'artist': Artist.query.count(), 'show': Show.query.count()}
+      seeking = {'venue': [row.id for row in db.session.query(Venue.id).filter(Venue.seeking_talent)],
+                 'artist': [row.id for row in db.session.query(Artist.id).filter(Artist.seeking_venue)]}
+    else:
+      counts = {'venue': args.venues, 'artist': args.artists, 'show': args.shows}
+      seeking = None
+    db.session.remove()
+
+  routes = [route for route in ROUTES if not args.route or route[0] in args.route]
+  driver = RouteDriver(counts, url=args.url, seeking=seeking)
+  try:
+    sequential = {}
+    for route in routes:
+      samples = [driver.request(route) for _ in range(args.requests)]
+      sequential[route[0]] = dict(summarize(samples), rss_mb=rss_mb())
+    print_results(f'Sequential, {args.requests} requests per route', sequential)
+
+    by_route = {route[0]: [] for route in routes}
+    def worker(seed):
+      rng = random.Random(seed)
+      for _ in range(args.load_requests // args.concurrency):
+        route = rng.choice(routes)
+        by_route[route[0]].append(driver.request(route))
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+      list(pool.map(worker, range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    load = {label: summarize(samples) for label, samples in by_route.items() if samples}
+    total = sum(result['requests'] for result in load.values())
+    print_results(f'Load, {args.concurrency} concurrent clients: {total / elapsed:.0f} requests/s, '
+                  f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:.0f} MB', load)
+  finally:
+    driver.close()
+
+  if args.write_baseline:
+    with open(args.write_baseline, 'w') as file:
+      json.dump({label: {'p95_ms': result['p95_ms'], 'queries': result['queries']}
+                 for label, result in sequential.items()}, file, indent=2, sort_keys=True)
+      file.write('\n')
+    print(f'Wrote {args.write_baseline}')
+  if args.baseline and not os.path.exists(args.baseline):
+    print(f'No baseline at {args.baseline}; skipping the comparison '
+          f'(record one with: benchmark.py routes --write-baseline {args.baseline})')
+  elif args.baseline:
+    with open(args.baseline) as file:
+      for regression in compare_baseline(sequential, json.load(file), args.tolerance):
+        print('WARN', regression)
+  failures = check_query_budgets(sequential) + check_errors(sequential)
+  for failure in failures:
+    print('FAIL', failure)
+  if failures:
+    sys.exit(f'{len(failures)} routes over their statement budget or failing')
+  print('Statements within budget')
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Fyyur benchmarks')
+  subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+  search = subparsers.add_parser('search', help='ILIKE name search with and without the pg_trgm index')
+  search.add_argument('--rows', type=int, default=100000)
+  search.add_argument('--repeat', type=int, default=20)
+  search.add_argument('--no-seed', action='store_true', help='reuse the data already in the database')
+  search.set_defaults(func=bench_search)
+
+  explain = subparsers.add_parser('explain', help='check that detail page queries use the show indexes')
+  explain.set_defaults(func=bench_explain)
+
+  datetime_filter = subparsers.add_parser('datetime-filter', help='format_datetime template filter')
+  datetime_filter.add_argument('--shows', type=int, default=10000)
+  datetime_filter.add_argument('--distinct', type=int, default=2000)
+  datetime_filter.add_argument('--repeat', type=int, default=10)
+  datetime_filter.set_defaults(func=bench_datetime_filter)
+
+  routes = subparsers.add_parser('routes', help='latency, statements per request and RSS for every read route')
+  routes.add_argument('--venues', type=int, default=10000)
+  routes.add_argument('--artists', type=int, default=50000)
+  routes.add_argument('--shows', type=int, default=1000000)
+  routes.add_argument('--reseed', action='store_true', help='reseed even if the database already has data')
+  routes.add_argument('--requests', type=int, default=100, help='sequential requests per route')
+  routes.add_argument('--concurrency', type=int, default=8)
+  routes.add_argument('--load-requests', type=int, default=2000, help='total requests in the load pass')
+  routes.add_argument('--route', action='append', help='only this route label (repeatable)')
+  routes.add_argument('--url', help='drive a running server instead of the test client; '
+                                    '--venues/--artists/--shows then give its id ranges')
+  routes.add_argument('--baseline', help='report regressions against this baseline file, if it exists')
+  routes.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth over the baseline')
+  routes.add_argument('--write-baseline', metavar='PATH', help='record this run as the baseline')
+  routes.set_defaults(func=bench_routes)
+
+  args = parser.parse_args(argv)
+  args.func(args)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,145 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, session
+
+class LRUCacheBackend:
+  # In-process LRU with per-entry expiry. Each worker process keeps its own
+  # copy, so invalidation only reaches the process that handled the write;
+  # use the Redis backend when running several workers.
+
+  def __init__(self, max_entries=1024):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.evictions = 0
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, expires_at = entry
+      if expires_at <= time.monotonic():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl):
+    with self.lock:
+      self.entries[key] = (value, time.monotonic() + ttl)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def __len__(self):
+    return len(self.entries)
+
+class RedisCacheBackend:
+  # Shared cache for multi-process deployments. Works with any server that
+  # speaks the Redis protocol; eviction is left to the server's maxmemory
+  # policy, so it is not counted here.
+
+  def __init__(self, url, prefix='fyyur:page:'):
+    import redis
+    self.client = redis.Redis.from_url(url)
+    self.prefix = prefix
+    self.evictions = 0
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    return value.decode('utf-8') if value is not None else None
+
+  def set(self, key, value, ttl):
+    self.client.set(self.prefix + key, value.encode('utf-8'), ex=max(1, int(ttl)))
+
+  def delete(self, key):
+    self.client.delete(self.prefix + key)
+
+  def __len__(self):
+    return sum(1 for _ in self.client.scan_iter(self.prefix + '*'))
+
+class PageCache:
+  # Caches the rendered HTML of entity pages keyed by (kind, id).
+  #
+  # Views opt in with @page_cache.cached('venue', 'venue_id') and may set
+  # g.page_cache_expires_at to expire an entry early, e.g. when the next
+  # upcoming show starts. Writers call invalidate() after committing.
+
+  def __init__(self, app=None):
+    self.backend = None
+    self.ttl = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    backend = app.config.get('PAGE_CACHE_BACKEND')
+    self.ttl = app.config.get('PAGE_CACHE_TTL', 300)
+    if backend == 'memory':
+      self.backend = LRUCacheBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024))
+    elif backend == 'redis':
+      self.backend = RedisCacheBackend(app.config['PAGE_CACHE_REDIS_URL'])
+    elif backend is not None:
+      raise ValueError(f'Unknown PAGE_CACHE_BACKEND: {backend}')
+
+  @staticmethod
+  def key(kind, entity_id):
+    return f'{kind}:{int(entity_id)}'
+
+  def cached(self, kind, id_arg):
+    def decorator(view):
+      @wraps(view)
+      def wrapper(*args, **kwargs):
+        # Pages carrying flashed messages are per-user; never serve or store them.
+        if self.backend is None or session.get('_flashes'):
+          return view(*args, **kwargs)
+        key = self.key(kind, kwargs[id_arg])
+        html = self.backend.get(key)
+        if html is not None:
+          self._count('hits')
+          return html, 200, {'X-Page-Cache': 'HIT'}
+        self._count('misses')
+        result = view(*args, **kwargs)
+        if isinstance(result, str):
+          ttl = self.ttl
+          expires_at = g.pop('page_cache_expires_at', None)
+          if expires_at is not None:
+            ttl = min(ttl, (expires_at - datetime.datetime.now()).total_seconds())
+          if ttl > 0:
+            self.backend.set(key, result, ttl)
+          return result, 200, {'X-Page-Cache': 'MISS'}
+        return result
+      return wrapper
+    return decorator
+
+  def invalidate(self, keys):
+    # keys: iterable of (kind, id) pairs.
+    if self.backend is None:
+      return
+    for kind, entity_id in keys:
+      self.backend.delete(self.key(kind, entity_id))
+
+  def _count(self, counter):
+    with self.lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+
+  def stats(self):
+    return {
+      'backend': type(self.backend).__name__ if self.backend is not None else None,
+      'entries': len(self.backend) if self.backend is not None else 0,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.backend.evictions if self.backend is not None else 0,
+    }
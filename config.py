@@ -12,3 +12,99 @@ DEBUG = True
 # TODO IMPLEMENT DATABASE URL
 SQLALCHEMY_DATABASE_URI = 'postgres://postgres@localhost:5432/fyyur'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool, per environment. pool_size + max_overflow connections per
+# worker process must fit within the server's max_connections.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+}
+# Read replicas (comma separated URIs) for read-only views. Replica engines
+# use the same pool options as the primary.
+SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DB_REPLICA_URIS', '').split(',') if uri]
+# 'round_robin' or 'least_connections'
+REPLICA_BALANCING = os.environ.get('DB_REPLICA_BALANCING', 'round_robin')
+# After a write, the writing client reads from the primary for this long
+REPLICA_STICKY_SECONDS = 5
+# Connection checkouts that wait at least this long are logged
+DB_POOL_SLOW_CHECKOUT_MS = float(os.environ.get('DB_POOL_SLOW_CHECKOUT_MS', 100))
+
+# Maximum number of rows returned by the venue and artist search pages
+SEARCH_RESULT_LIMIT = 50
+# Maximum suggestions per typeahead request, and how often each worker
+# reloads its typeahead index to pick up other workers' writes (0 = never)
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_REFRESH_SECONDS = 300
+
+# Venue/artist matchmaking: score weights (genre is a cosine similarity in
+# [0, 1]; city, state and history are 0 or 1, history saturating at
+# MATCH_HISTORY_CAP past shows together), candidates kept per entity, and
+# how often each worker reloads the profiles (0 = never)
+MATCH_WEIGHTS = {'genre': 1.0, 'city': 0.5, 'state': 0.2, 'history': 0.5}
+MATCH_HISTORY_CAP = 3
+MATCH_CANDIDATES = 50
+MATCH_REFRESH_SECONDS = 300
+
+# Default and maximum number of rows per page on the listing pages
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Length of a show listed without an end time or duration
+SHOW_DEFAULT_DURATION_MINUTES = 120
+# Longest date range /api/v1/shows/calendar counts over
+CALENDAR_MAX_DAYS = 366
+
+# In debug mode, log (or raise, with QUERY_COUNT_RAISE) when a request
+# issues more than this many SQL statements. None disables the check.
+QUERY_COUNT_LIMIT = 10
+QUERY_COUNT_RAISE = False
+
+# Rendered venue/artist page cache: 'memory' (per-process LRU), 'redis'
+# (shared, needs the redis package) or None to disable
+PAGE_CACHE_BACKEND = 'memory'
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_MAX_ENTRIES = 1024
+PAGE_CACHE_REDIS_URL = os.environ.get('PAGE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Locale used by the datetime template filter
+DATETIME_LOCALE = 'en_US'
+
+# Rows fetched per database round trip (and per chunk) by streaming API lists
+API_STREAM_BATCH_SIZE = 1000
+
+# Per-request SQL and render profiling: Server-Timing headers plus a JSON
+# lines log of requests slower than PROFILE_SLOW_REQUEST_MS, of which
+# PROFILE_LOG_SAMPLE_RATE are written
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true'
+PROFILE_SLOW_REQUEST_MS = 500
+PROFILE_LOG_SAMPLE_RATE = 1.0
+PROFILE_SLOWEST_STATEMENTS = 5
+PROFILE_SLOW_LOG = os.path.join(basedir, 'slow_requests.log')
+
+# Prometheus metrics at /metrics (needs prometheus_client). For pre-fork
+# servers also set PROMETHEUS_MULTIPROC_DIR, see instrumentation.py.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Bearer token (Authorization: Bearer <token>) required by /internal/* and
+# /metrics; unset, those endpoints answer 404
+INTERNAL_TOKEN = os.environ.get('INTERNAL_TOKEN')
+
+# Cache-Control for the conditional GET pages, by endpoint. Responses carry
+# an ETag, so 'no-cache' only costs a revalidation. Avoid max-age on pages
+# that edits redirect to (show_venue, show_artist) or that list edited rows:
+# a browser holding a fresh copy would show the pre-edit page and drop the
+# flashed message.
+CACHE_CONTROL_DEFAULT = 'no-cache'
+CACHE_CONTROL = {}
+
+# Nearest-venue searches (?lat=&lng= without a radius) start looking within
+# this many km and widen fourfold until they have a page of venues
+NEAREST_VENUES_START_KM = 10
+
+# Incremental exports (`flask export --state`) start this long before the
+# previous export did, to pick up rows committed late with an earlier
+# updated_at
+EXPORT_OVERLAP_SECONDS = 600
@@ -5,9 +5,23 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    # Unit tests; the database-backed ones run against the scratch
+    # PostgreSQL database in TEST_DATABASE_URI and are skipped without it.
+    with settings(warn_only=True):
+        result = local("python -m pytest -q tests", capture=True)
+    if result.failed and not confirm("Tests failed. Continue?"):
+        abort("Aborted at user request.")
+    # Route benchmarks against the scratch database in BENCHMARK_DATABASE_URI,
+    # reseeded with a small catalog: statement counts do not depend on its
+    # size. Fails when a page exceeds its statement budget (QUERY_BUDGETS) or
+    # answers 5xx; latency against the baseline, when one has been recorded
+    # with `python benchmark.py routes --write-baseline benchmark_baseline.json`,
+    # is only reported.
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python benchmark.py routes --reseed --venues 200 --artists 1000 --shows 20000"
+            " --requests 20 --load-requests 400 --baseline benchmark_baseline.json",
+            capture=True,
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
@@ -39,9 +53,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run flask recount --check")
 
 
 def deploy():
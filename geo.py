@@ -0,0 +1,56 @@
+import math
+
+# Venues are bucketed into a fixed grid of CELL_DEGREES x CELL_DEGREES cells,
+# numbered row by row eastwards from (-90, -180). Each venue stores its cell
+# number under a plain btree index, so a radius search reads a few ranges of
+# cell numbers (one per grid row the circle spans) instead of the whole
+# table, with no PostGIS or other extension. Changing CELL_DEGREES means
+# reloading the gazetteer and running `flask geocode venues --all`.
+
+EARTH_RADIUS_KM = 6371.0088
+# Half the Earth's circumference: no two points are further apart.
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+CELL_DEGREES = 0.1
+ROWS = round(180 / CELL_DEGREES)
+COLUMNS = round(360 / CELL_DEGREES)
+# Beyond this many ranges a search reads the whole latitude band instead.
+MAX_RANGES = 64
+
+def cell_row(latitude):
+  return min(ROWS - 1, max(0, math.floor((latitude + 90) / CELL_DEGREES)))
+
+def cell_column(longitude):
+  return math.floor(((longitude + 180) % 360) / CELL_DEGREES) % COLUMNS
+
+def cell(latitude, longitude):
+  return cell_row(latitude) * COLUMNS + cell_column(longitude)
+
+def cell_ranges(latitude, longitude, radius_km):
+  # Inclusive (first, last) cell number ranges covering every point within
+  # radius_km of (latitude, longitude), adjacent ranges merged. The circle's
+  # bounding box is widest in longitude at its tangent points, asin(sin(r) /
+  # cos(latitude)) either side of the centre.
+  angle = radius_km / EARTH_RADIUS_KM
+  south = latitude - math.degrees(angle)
+  north = latitude + math.degrees(angle)
+  spread = math.sin(angle) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else 2
+  if south <= -90 or north >= 90 or angle >= math.pi / 2 or spread >= 1:
+    # The circle reaches a pole or wraps the globe: every longitude.
+    spans = [(0, COLUMNS - 1)]
+  else:
+    west_east = math.degrees(math.asin(spread))
+    west, east = cell_column(longitude - west_east), cell_column(longitude + west_east)
+    spans = [(west, east)] if west <= east else [(0, east), (west, COLUMNS - 1)]
+
+  first_row, last_row = cell_row(south), cell_row(north)
+  if (last_row - first_row + 1) * len(spans) > MAX_RANGES:
+    return [(first_row * COLUMNS, last_row * COLUMNS + COLUMNS - 1)]
+  ranges = []
+  for row in range(first_row, last_row + 1):
+    for first, last in spans:
+      first, last = row * COLUMNS + first, row * COLUMNS + last
+      if ranges and ranges[-1][1] + 1 == first:
+        ranges[-1] = (ranges[-1][0], last)
+      else:
+        ranges.append((first, last))
+  return ranges
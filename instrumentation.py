@@ -0,0 +1,301 @@
+import bisect
+import heapq
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+def internal_only(view):
+  # For /internal/* and /metrics: 404 unless the request carries
+  # `Authorization: Bearer <INTERNAL_TOKEN>`. With no token configured the
+  # endpoints cannot be reached at all.
+  @wraps(view)
+  def wrapper(*args, **kwargs):
+    token = current_app.config.get('INTERNAL_TOKEN')
+    supplied = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+      abort(404)
+    return view(*args, **kwargs)
+  return wrapper
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+  if has_request_context():
+    g.query_count = g.get('query_count', 0) + 1
+
+def reset_statement_count():
+  g.query_count = 0
+
+def count_statements(app):
+  # The one per-request statement counter, g.query_count, read by the debug
+  # query guard, RequestProfiler and PrometheusMetrics. Safe to call more
+  # than once.
+  if not event.contains(Engine, 'before_cursor_execute', count_statement):
+    event.listen(Engine, 'before_cursor_execute', count_statement)
+  if reset_statement_count not in app.before_request_funcs.get(None, []):
+    app.before_request(reset_statement_count)
+
+class Histogram:
+  # Fixed-bucket histogram. Bucket bounds are preallocated; observe() is a
+  # bisect and two additions under a lock.
+
+  def __init__(self, bounds):
+    self.bounds = list(bounds)
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.sum = 0.0
+    self.lock = threading.Lock()
+
+  def observe(self, value):
+    index = bisect.bisect_left(self.bounds, value)
+    with self.lock:
+      self.counts[index] += 1
+      self.sum += value
+
+  def snapshot(self):
+    # Cumulative counts per upper bound, Prometheus style.
+    with self.lock:
+      counts = list(self.counts)
+      total = self.sum
+    buckets = {}
+    running = 0
+    for bound, count in zip(self.bounds + ['+Inf'], counts):
+      running += count
+      buckets[str(bound)] = running
+    return {'buckets': buckets, 'count': running, 'sum': total}
+
+# Connection checkout wait, in milliseconds.
+CHECKOUT_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class TimedQueuePool(QueuePool):
+  # QueuePool that records how long each checkout waited for a connection
+  # and logs checkouts slower than slow_checkout_ms.
+
+  slow_checkout_ms = 100
+  logger = logging.getLogger(__name__)
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.checkout_wait = Histogram(CHECKOUT_WAIT_BUCKETS_MS)
+
+  def _do_get(self):
+    start = time.perf_counter()
+    try:
+      return super()._do_get()
+    finally:
+      waited_ms = (time.perf_counter() - start) * 1000
+      self.checkout_wait.observe(waited_ms)
+      if waited_ms >= self.slow_checkout_ms:
+        self.logger.warning('Slow connection checkout: waited %.1f ms (%s)', waited_ms, self.status())
+
+  def recreate(self):
+    pool = super().recreate()
+    pool.checkout_wait = self.checkout_wait
+    return pool
+
+  def metrics(self):
+    return {
+      'size': self.size(),
+      'checked_out': self.checkedout(),
+      'checked_in': self.checkedin(),
+      'overflow': max(0, self.overflow()),
+      'max_overflow': self._max_overflow,
+      'checkout_wait_ms': self.checkout_wait.snapshot(),
+    }
+
+class TimedTemplate(Template):
+  # Reports top-level template render times to each callable in observers
+  # as (template name, milliseconds). Included and extended templates
+  # render inside the top-level call.
+
+  observers = []
+
+  def render(self, *args, **kwargs):
+    if not self.observers:
+      return super().render(*args, **kwargs)
+    start = time.perf_counter()
+    try:
+      return super().render(*args, **kwargs)
+    finally:
+      elapsed_ms = (time.perf_counter() - start) * 1000
+      for observer in self.observers:
+        observer(self.name, elapsed_ms)
+
+class RequestProfiler:
+  # Opt-in (PROFILE_REQUESTS) per-request profile: statement count, total
+  # database time, template render time and the slowest statements. Every
+  # profiled response gets a Server-Timing header; requests slower than
+  # PROFILE_SLOW_REQUEST_MS are written, sampled at PROFILE_LOG_SAMPLE_RATE,
+  # as JSON lines to PROFILE_SLOW_LOG.
+
+  def __init__(self, app=None):
+    self.enabled = False
+    self.logger = logging.getLogger('fyyur.slow_requests')
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.enabled = app.config.get('PROFILE_REQUESTS', False)
+    if not self.enabled:
+      return
+    self.slow_request_ms = app.config.get('PROFILE_SLOW_REQUEST_MS', 500)
+    self.sample_rate = app.config.get('PROFILE_LOG_SAMPLE_RATE', 1.0)
+    self.slowest_statements = app.config.get('PROFILE_SLOWEST_STATEMENTS', 5)
+    self.logger.propagate = False
+    self.logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(app.config.get('PROFILE_SLOW_LOG', 'slow_requests.log'))
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    self.logger.addHandler(handler)
+
+    app.jinja_env.template_class = TimedTemplate
+    TimedTemplate.observers.append(self.template_rendered)
+    count_statements(app)
+    app.before_request(self.start_request)
+    app.after_request(self.finish_request)
+    event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+  def start_request(self):
+    g.profile = {'start': time.perf_counter(), 'db_ms': 0.0, 'render_ms': 0.0, 'statements': []}
+
+  def template_rendered(self, name, elapsed_ms):
+    if has_request_context() and 'profile' in g:
+      g.profile['render_ms'] += elapsed_ms
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+      conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'profile' in g) or not conn.info.get('query_start'):
+      return
+    elapsed_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+    profile = g.profile
+    profile['db_ms'] += elapsed_ms
+    # Min-heap of the slowest statements seen so far.
+    entry = (elapsed_ms, g.get('query_count', 0), statement)
+    if len(profile['statements']) < self.slowest_statements:
+      heapq.heappush(profile['statements'], entry)
+    else:
+      heapq.heappushpop(profile['statements'], entry)
+
+  def finish_request(self, response):
+    profile = g.pop('profile', None)
+    if profile is None:
+      return response
+    total_ms = (time.perf_counter() - profile['start']) * 1000
+    queries = g.get('query_count', 0)
+    response.headers.add('Server-Timing', ', '.join([
+      f'db;dur={profile["db_ms"]:.1f};desc="{queries} queries"',
+      f'render;dur={profile["render_ms"]:.1f}',
+      f'total;dur={total_ms:.1f}',
+    ]))
+    if total_ms >= self.slow_request_ms and random.random() < self.sample_rate:
+      self.logger.info(json.dumps({
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'total_ms': round(total_ms, 1),
+        'db_ms': round(profile['db_ms'], 1),
+        'render_ms': round(profile['render_ms'], 1),
+        'queries': queries,
+        'slowest_statements': [{'ms': round(ms, 1), 'statement': statement}
+                               for ms, _, statement in sorted(profile['statements'], reverse=True)],
+      }))
+    return response
+
+# Request latency, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+# Template render time, in seconds.
+RENDER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Statements per request.
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+class PrometheusMetrics:
+  # Prometheus metrics for every endpoint, served at /metrics to scrapers
+  # sending the INTERNAL_TOKEN bearer token. Needs the prometheus_client
+  # package.
+  #
+  # Under a pre-fork server set PROMETHEUS_MULTIPROC_DIR to an empty
+  # directory shared by the workers before the app is imported; each worker
+  # then writes its samples to its own memory-mapped files and /metrics
+  # aggregates them. The server should call
+  # prometheus_client.multiprocess.mark_process_dead(pid) when a worker exits.
+
+  def __init__(self, app=None):
+    self.enabled = False
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.enabled = app.config.get('METRICS_ENABLED', False)
+    if not self.enabled:
+      return
+    import prometheus_client
+    self.prometheus_client = prometheus_client
+    self.registry = prometheus_client.CollectorRegistry()
+    self.requests = prometheus_client.Counter(
+      'fyyur_http_requests_total', 'HTTP requests.', ['endpoint', 'method', 'status'], registry=self.registry)
+    self.latency = prometheus_client.Histogram(
+      'fyyur_http_request_duration_seconds', 'HTTP request latency.', ['endpoint'],
+      buckets=LATENCY_BUCKETS, registry=self.registry)
+    self.in_flight = prometheus_client.Gauge(
+      'fyyur_http_requests_in_flight', 'HTTP requests being handled.', ['endpoint'],
+      multiprocess_mode='livesum', registry=self.registry)
+    self.queries = prometheus_client.Histogram(
+      'fyyur_db_queries_per_request', 'SQL statements issued per request.', ['endpoint'],
+      buckets=QUERY_COUNT_BUCKETS, registry=self.registry)
+    self.render = prometheus_client.Histogram(
+      'fyyur_template_render_duration_seconds', 'Template render time.', ['template'],
+      buckets=RENDER_BUCKETS, registry=self.registry)
+
+    app.jinja_env.template_class = TimedTemplate
+    TimedTemplate.observers.append(self.template_rendered)
+    count_statements(app)
+    app.before_request(self.start_request)
+    app.after_request(self.finish_request)
+    app.teardown_request(self.teardown_request)
+    app.add_url_rule('/metrics', 'metrics', internal_only(self.export))
+
+  @staticmethod
+  def endpoint():
+    return request.endpoint or 'unmatched'
+
+  def start_request(self):
+    g.metrics = {'start': time.perf_counter()}
+    self.in_flight.labels(self.endpoint()).inc()
+
+  def template_rendered(self, name, elapsed_ms):
+    self.render.labels(name or 'string').observe(elapsed_ms / 1000)
+
+  def finish_request(self, response):
+    metrics = g.get('metrics')
+    if metrics is not None:
+      endpoint = self.endpoint()
+      self.requests.labels(endpoint, request.method, str(response.status_code)).inc()
+      self.latency.labels(endpoint).observe(time.perf_counter() - metrics['start'])
+      self.queries.labels(endpoint).observe(g.get('query_count', 0))
+    return response
+
+  def teardown_request(self, exception=None):
+    if g.pop('metrics', None) is not None:
+      self.in_flight.labels(self.endpoint()).dec()
+
+  def export(self):
+    prometheus_client = self.prometheus_client
+    registry = self.registry
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ or 'prometheus_multiproc_dir' in os.environ:
+      from prometheus_client import multiprocess
+      registry = prometheus_client.CollectorRegistry()
+      multiprocess.MultiProcessCollector(registry)
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
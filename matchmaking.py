@@ -0,0 +1,231 @@
+import bisect
+import threading
+import time
+
+OTHER_SIDE = {'venue': 'artist', 'artist': 'venue'}
+
+class ProfilePool:
+  # The seeking profiles of one side (venues seeking talent or artists
+  # seeking a venue) as parallel NumPy arrays, one slot per profile, so a
+  # query is scored against the whole pool at once. Slots of removed
+  # profiles are reused.
+
+  def __init__(self, genres, codes, capacity=64):
+    import numpy
+    self.np = numpy
+    self.genre_index = {genre: i for i, genre in enumerate(genres)}
+    self.codes = codes
+    self.slots = {}
+    self.free = []
+    self.ids = numpy.zeros(0, dtype=numpy.int64)
+    self.genres = numpy.zeros((0, len(genres)), dtype=bool)
+    self.city = numpy.zeros(0, dtype=numpy.int32)
+    self.state = numpy.zeros(0, dtype=numpy.int32)
+    self.active = numpy.zeros(0, dtype=bool)
+    self._grow(capacity)
+
+  def _grow(self, capacity):
+    np = self.np
+    extra = capacity - len(self.ids)
+    self.free.extend(range(len(self.ids) + extra - 1, len(self.ids) - 1, -1))
+    self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+    self.genres = np.concatenate([self.genres, np.zeros((extra, self.genres.shape[1]), dtype=bool)])
+    self.city = np.concatenate([self.city, np.zeros(extra, dtype=np.int32)])
+    self.state = np.concatenate([self.state, np.zeros(extra, dtype=np.int32)])
+    self.active = np.concatenate([self.active, np.zeros(extra, dtype=bool)])
+
+  def knows_genres(self, genres):
+    return all(genre in self.genre_index for genre in genres)
+
+  def genre_vector(self, genres):
+    vector = self.np.zeros(len(self.genre_index), dtype=bool)
+    vector[[self.genre_index[genre] for genre in genres if genre in self.genre_index]] = True
+    return vector
+
+  def upsert(self, entity_id, genres, city, state):
+    slot = self.slots.get(entity_id)
+    if slot is None:
+      if not self.free:
+        self._grow(2 * len(self.ids))
+      slot = self.free.pop()
+      self.slots[entity_id] = slot
+    self.ids[slot] = entity_id
+    self.genres[slot] = self.genre_vector(genres)
+    self.city[slot] = self.codes.code('city', state, city)
+    self.state[slot] = self.codes.code('state', state)
+    self.active[slot] = True
+
+  def remove(self, entity_id):
+    slot = self.slots.pop(entity_id, None)
+    if slot is not None:
+      self.active[slot] = False
+      self.free.append(slot)
+
+  def scores(self, genres, city, state, history, weights, history_cap):
+    # Score of every slot against one profile of the other side:
+    #   genre:   cosine similarity of the genre sets, in [0, 1]
+    #   city:    same city (and state)
+    #   state:   same state
+    #   history: past shows together, saturating at history_cap
+    # Inactive slots score -inf.
+    np = self.np
+    query = self.genre_vector(genres)
+    overlap = self.genres[:, query].sum(axis=1)
+    norms = np.sqrt(self.genres.sum(axis=1) * max(1, int(query.sum())))
+    genre_score = np.divide(overlap, norms, out=np.zeros(len(overlap)), where=norms > 0)
+    same_state = self.state == self.codes.code('state', state)
+    same_city = same_state & (self.city == self.codes.code('city', state, city))
+    shows = np.zeros(len(self.ids))
+    for other_id, count in history.items():
+      slot = self.slots.get(other_id)
+      if slot is not None:
+        shows[slot] = count
+    score = (weights['genre'] * genre_score
+             + weights['city'] * same_city
+             + weights['state'] * same_state
+             + weights['history'] * np.minimum(shows, history_cap) / history_cap)
+    score[~self.active] = -np.inf
+    return score
+
+  def top(self, scores, limit):
+    # (score, id) pairs of the `limit` best positive scores, best first,
+    # ties broken by id.
+    np = self.np
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > limit:
+      # Everything scoring at least the limit-th best, ties included.
+      cutoff = -np.partition(-scores[candidates], limit - 1)[limit - 1]
+      candidates = candidates[scores[candidates] >= cutoff]
+    ranked = sorted(zip(-scores[candidates], self.ids[candidates]))[:limit]
+    return [(-float(score), int(entity_id)) for score, entity_id in ranked]
+
+class Codes:
+  # Interns city and state names as small integers for vectorized equality.
+
+  def __init__(self):
+    self.values = {}
+
+  def code(self, *key):
+    key = tuple((part or '').strip().casefold() for part in key)
+    return self.values.setdefault(key, len(self.values) + 1)
+
+class Matchmaker:
+  # Recommends artists seeking a venue to venues seeking talent, and the
+  # other way round, ranked by genre overlap, location and past shows
+  # together (weights in MATCH_WEIGHTS).
+  #
+  # Each side's seeking profiles are loaded on first use into a ProfilePool
+  # with the loaders given to register(). The best MATCH_CANDIDATES
+  # candidates of every entity asked about are kept; when a profile changes,
+  # profile_changed() rescores just that profile against the cached
+  # entities of the other side and patches their lists in place. As with
+  # the typeahead index each worker holds its own copy, so everything is
+  # reloaded every MATCH_REFRESH_SECONDS (0 disables reloading).
+
+  def __init__(self, app=None):
+    self.profiles = {}
+    self.histories = {}
+    self.pools = None
+    self.loaded_at = None
+    self.candidates = {}
+    self.lock = threading.RLock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.weights = app.config.get('MATCH_WEIGHTS', {'genre': 1.0, 'city': 0.5, 'state': 0.2, 'history': 0.5})
+    self.history_cap = app.config.get('MATCH_HISTORY_CAP', 3)
+    self.limit = app.config.get('MATCH_CANDIDATES', 50)
+    self.refresh_seconds = app.config.get('MATCH_REFRESH_SECONDS', 300)
+
+  def register(self, kind, profiles, history):
+    # profiles() returns (id, genres, city, state) for every entity of
+    # `kind` that is seeking; history(id) returns {other side id: number of
+    # past shows together} for one entity of `kind`.
+    self.profiles[kind] = profiles
+    self.histories[kind] = history
+
+  def load(self, genres=()):
+    rows = {kind: list(profiles()) for kind, profiles in self.profiles.items()}
+    vocabulary = list(genres)
+    for kind_rows in rows.values():
+      vocabulary.extend(genre for row in kind_rows for genre in row[1] or ())
+    vocabulary = list(dict.fromkeys(vocabulary))
+    codes = Codes()
+    pools = {}
+    for kind, kind_rows in rows.items():
+      pool = ProfilePool(vocabulary, codes, capacity=max(64, len(kind_rows)))
+      for entity_id, entity_genres, city, state in kind_rows:
+        pool.upsert(entity_id, entity_genres or (), city, state)
+      pools[kind] = pool
+    self.pools = pools
+    self.candidates = {}
+    self.loaded_at = time.monotonic()
+
+  def ensure_loaded(self, genres=()):
+    stale = (self.loaded_at is None or
+             (self.refresh_seconds and time.monotonic() - self.loaded_at >= self.refresh_seconds))
+    if stale or not all(pool.knows_genres(genres) for pool in self.pools.values()):
+      self.load(genres)
+
+  def recommend(self, kind, entity_id, genres, city, state, limit=None):
+    # [(score, id), ...] of the best other-side candidates for one entity.
+    limit = max(1, min(limit or self.limit, self.limit))
+    with self.lock:
+      self.ensure_loaded(genres or ())
+      key = (kind, entity_id)
+      if key not in self.candidates:
+        pool = self.pools[OTHER_SIDE[kind]]
+        scores = pool.scores(genres or (), city, state, self.histories[kind](entity_id), self.weights, self.history_cap)
+        self.candidates[key] = pool.top(scores, self.limit)
+      return self.candidates[key][:limit]
+
+  def profile_changed(self, kind, entity_id, genres=None, city=None, state=None, seeking=False):
+    # Call after committing a create, edit or delete (seeking=False).
+    with self.lock:
+      self.candidates.pop((kind, entity_id), None)
+      if self.pools is None:
+        return
+      if seeking and not all(pool.knows_genres(genres or ()) for pool in self.pools.values()):
+        # A genre outside the vocabulary: rebuild everything on next use.
+        self.loaded_at = None
+        return
+      pool = self.pools[kind]
+      if seeking:
+        pool.upsert(entity_id, genres or (), city, state)
+      else:
+        pool.remove(entity_id)
+
+      other = OTHER_SIDE[kind]
+      affected = [key for key in self.candidates if key[0] == other]
+      if not affected:
+        return
+      new_scores = {}
+      if seeking:
+        # Pair scores are symmetric, so this entity's score in every other
+        # side list is its own score against the other side's pool.
+        other_pool = self.pools[other]
+        scores = other_pool.scores(genres or (), city, state, self.histories[kind](entity_id),
+                                   self.weights, self.history_cap)
+        new_scores = {other_id: float(scores[slot]) for other_id, slot in other_pool.slots.items()}
+      for key in affected:
+        self._patch(key, entity_id, new_scores.get(key[1]))
+
+  def _patch(self, key, entity_id, score):
+    # Moves entity_id within one cached list, kept as (-score, id) order.
+    ranked = self.candidates[key]
+    full = len(ranked) >= self.limit
+    index = next((i for i, (_, candidate) in enumerate(ranked) if candidate == entity_id), None)
+    if index is not None:
+      del ranked[index]
+    # A list that is not full holds every positive candidate; a full one
+    # only takes scores that beat its last entry.
+    keys = [(-s, candidate) for s, candidate in ranked]
+    if score is not None and score > 0 and (not full or (keys and (-score, entity_id) < keys[-1])):
+      ranked.insert(bisect.bisect(keys, (-score, entity_id)), (score, entity_id))
+    if len(ranked) > self.limit:
+      del ranked[self.limit:]
+    elif full and len(ranked) < self.limit:
+      # A candidate left a full list; the next best is unknown, so the list
+      # is recomputed on next use.
+      del self.candidates[key]
@@ -0,0 +1,26 @@
+"""add GIN indexes on venue and artist genres
+
+Revision ID: 0b7d3e9f5a18
+Revises: f1a6c8d2b437
+Create Date: 2026-10-18 19:20:47.881502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7d3e9f5a18'
+down_revision = 'f1a6c8d2b437'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venue_genres', 'venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artist_genres', 'artist', ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artist_genres', table_name='artist')
+    op.drop_index('ix_venue_genres', table_name='venue')
@@ -0,0 +1,26 @@
+"""add keyset pagination indexes
+
+Revision ID: 5c8e2d1f7a60
+Revises: 3b1f0c2a9d47
+Create Date: 2026-10-18 11:40:05.917260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e2d1f7a60'
+down_revision = '3b1f0c2a9d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venue_state_city_id', 'venue', ['state', 'city', 'id'], unique=False)
+    op.create_index('ix_show_start_time_id', 'show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_start_time_id', table_name='show')
+    op.drop_index('ix_venue_state_city_id', table_name='venue')
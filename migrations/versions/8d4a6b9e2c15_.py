@@ -0,0 +1,26 @@
+"""add show (venue_id, start_time) and (artist_id, start_time) indexes
+
+Revision ID: 8d4a6b9e2c15
+Revises: 5c8e2d1f7a60
+Create Date: 2026-10-18 12:25:47.301158
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4a6b9e2c15'
+down_revision = '5c8e2d1f7a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_artist_id_start_time', table_name='show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
@@ -0,0 +1,39 @@
+"""add venue coordinates, grid cell index and geocode gazetteer
+
+Revision ID: 9c4f2b7e1d36
+Revises: 0b7d3e9f5a18
+Create Date: 2026-10-18 21:05:12.318407
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4f2b7e1d36'
+down_revision = '0b7d3e9f5a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('geocode',
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=False),
+    sa.Column('longitude', sa.Float(), nullable=False),
+    sa.Column('geo_cell', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('city', 'state')
+    )
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('geo_cell', sa.Integer(), nullable=True))
+    op.create_index('ix_venue_geo_cell', 'venue', ['geo_cell'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_geo_cell', table_name='venue')
+    op.drop_column('venue', 'geo_cell')
+    op.drop_column('venue', 'longitude')
+    op.drop_column('venue', 'latitude')
+    op.drop_table('geocode')
@@ -0,0 +1,28 @@
+"""add updated_at to venue, artist and show
+
+Revision ID: a7f3c5e81b02
+Revises: 8d4a6b9e2c15
+Create Date: 2026-10-18 14:03:19.660472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7f3c5e81b02'
+down_revision = '8d4a6b9e2c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venue', 'artist', 'show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('show', 'artist', 'venue'):
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,30 @@
+"""add upcoming_shows_count to venue and artist
+
+Revision ID: c2e9d4a7f613
+Revises: a7f3c5e81b02
+Create Date: 2026-10-18 15:37:52.104388
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e9d4a7f613'
+down_revision = 'a7f3c5e81b02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venue', sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('artist', sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE venue SET upcoming_shows_count = '
+               '(SELECT count(*) FROM show WHERE show.venue_id = venue.id AND show.start_time > localtimestamp)')
+    op.execute('UPDATE artist SET upcoming_shows_count = '
+               '(SELECT count(*) FROM show WHERE show.artist_id = artist.id AND show.start_time > localtimestamp)')
+
+
+def downgrade():
+    op.drop_column('artist', 'upcoming_shows_count')
+    op.drop_column('venue', 'upcoming_shows_count')
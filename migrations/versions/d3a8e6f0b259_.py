@@ -0,0 +1,46 @@
+"""add deletion log for incremental exports
+
+Revision ID: d3a8e6f0b259
+Revises: 9c4f2b7e1d36
+Create Date: 2026-10-18 23:41:07.905316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8e6f0b259'
+down_revision = '9c4f2b7e1d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('deletion',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_deletion_kind_deleted_at', 'deletion', ['kind', 'deleted_at'], unique=False)
+    op.execute('''
+    CREATE OR REPLACE FUNCTION record_deletion() RETURNS trigger AS $$
+    BEGIN
+      INSERT INTO deletion (kind, record_id, deleted_at) VALUES (TG_TABLE_NAME, OLD.id, now());
+      RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''')
+    for table in ('venue', 'artist', 'show'):
+        op.execute(f'CREATE TRIGGER {table}_record_deletion AFTER DELETE ON {table} '
+                   'FOR EACH ROW EXECUTE PROCEDURE record_deletion()')
+
+
+def downgrade():
+    for table in ('venue', 'artist', 'show'):
+        op.execute(f'DROP TRIGGER {table}_record_deletion ON {table}')
+    op.execute('DROP FUNCTION record_deletion()')
+    op.drop_index('ix_deletion_kind_deleted_at', table_name='deletion')
+    op.drop_table('deletion')
@@ -0,0 +1,47 @@
+"""add show end_time and exclusion constraints against double booking
+
+Revision ID: e5b8f1c3a924
+Revises: c2e9d4a7f613
+Create Date: 2026-10-18 18:12:40.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8f1c3a924'
+down_revision = 'c2e9d4a7f613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    # Existing shows get the default two hour slot.
+    op.execute("UPDATE show SET end_time = start_time + interval '120 minutes'")
+    op.alter_column('show', 'end_time', nullable=False)
+    op.create_check_constraint('ck_show_end_after_start', 'show', 'end_time > start_time')
+
+    # Report every existing double booking at once rather than the first
+    # one the constraint trips over.
+    connection = op.get_bind()
+    for column in ('venue_id', 'artist_id'):
+        overlaps = connection.execute(
+            f'SELECT a.id, b.id FROM show a JOIN show b ON a.{column} = b.{column} AND a.id < b.id '
+            f'AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time) '
+            f'ORDER BY a.id, b.id LIMIT 100').fetchall()
+        if overlaps:
+            pairs = ', '.join(f'{a}/{b}' for a, b in overlaps)
+            raise RuntimeError(f'Overlapping shows share a {column}; reschedule or delete one of each '
+                               f'pair (show ids, first 100) before upgrading: {pairs}')
+        op.execute(f'ALTER TABLE show ADD CONSTRAINT ex_show_{column}_during '
+                   f'EXCLUDE USING gist ({column} WITH =, tsrange(start_time, end_time) WITH &&)')
+
+
+def downgrade():
+    op.drop_constraint('ex_show_artist_id_during', 'show')
+    op.drop_constraint('ex_show_venue_id_during', 'show')
+    op.drop_constraint('ck_show_end_after_start', 'show')
+    op.drop_column('show', 'end_time')
@@ -0,0 +1,24 @@
+"""add lower(city) index on venue for the shows city filter
+
+Revision ID: f1a6c8d2b437
+Revises: e5b8f1c3a924
+Create Date: 2026-10-18 18:55:03.274119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a6c8d2b437'
+down_revision = 'e5b8f1c3a924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venue_lower_city', 'venue', [sa.text('lower(city)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_lower_city', table_name='venue')
@@ -0,0 +1,96 @@
+import itertools
+import time
+from functools import wraps
+
+import sqlalchemy
+from flask import g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import Delete, Insert, Update
+
+class ReplicaRouter:
+  # Engines for the read replicas in SQLALCHEMY_REPLICA_URIS and the policy
+  # for picking one. With no replicas configured every query stays on the
+  # primary.
+
+  def __init__(self):
+    self.engines = []
+    self.balancing = 'round_robin'
+    self.sticky_seconds = 0
+    self.counter = itertools.count()
+
+  def init_app(self, app):
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    self.engines = [sqlalchemy.create_engine(uri, **options) for uri in app.config.get('SQLALCHEMY_REPLICA_URIS', [])]
+    self.balancing = app.config.get('REPLICA_BALANCING', 'round_robin')
+    if self.balancing not in ('round_robin', 'least_connections'):
+      raise ValueError(f'Unknown REPLICA_BALANCING: {self.balancing}')
+    self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+    app.after_request(self.remember_write)
+
+  def choose(self):
+    if self.balancing == 'least_connections':
+      return min(self.engines, key=lambda engine: engine.pool.checkedout())
+    return self.engines[next(self.counter) % len(self.engines)]
+
+  def use_replica(self):
+    # Only inside read-only views, and not for a client that wrote recently
+    # (or in this request), so users always read their own writes.
+    return (self.engines and has_request_context() and g.get('read_only')
+            and not g.get('db_wrote') and session.get('primary_until', 0) <= time.time())
+
+  def remember_write(self, response):
+    if g.get('db_wrote') and self.sticky_seconds:
+      session['primary_until'] = time.time() + self.sticky_seconds
+    return response
+
+def reads_from_replica(view):
+  # Marks a view as read-only so its queries may be served by a replica.
+  @wraps(view)
+  def wrapper(*args, **kwargs):
+    g.read_only = True
+    return view(*args, **kwargs)
+  return wrapper
+
+def reads_from_primary(view):
+  # Sends the rest of the request back to the primary. Goes under
+  # @page_cache.cached on replica-read views: a page rendered on a miss is
+  # stored for every client, and a lagging replica could otherwise put the
+  # pre-edit page back in the cache right after an edit invalidated it.
+  @wraps(view)
+  def wrapper(*args, **kwargs):
+    g.read_only = False
+    return view(*args, **kwargs)
+  return wrapper
+
+class RoutingSession(SignallingSession):
+
+  def __init__(self, db, **options):
+    self.replicas = db.replicas
+    SignallingSession.__init__(self, db, **options)
+
+  def get_bind(self, mapper=None, clause=None):
+    if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+      if has_request_context():
+        g.db_wrote = True
+    elif self.replicas.use_replica():
+      # One replica per request, so a page reads one consistent snapshot.
+      if 'replica_engine' not in g:
+        g.replica_engine = self.replicas.choose()
+      return g.replica_engine
+    return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  # SQLAlchemy extension whose session sends reads from views marked with
+  # @reads_from_replica to a replica and everything else to the primary.
+
+  def __init__(self, *args, **kwargs):
+    self.replicas = ReplicaRouter()
+    SQLAlchemy.__init__(self, *args, **kwargs)
+
+  def init_app(self, app):
+    SQLAlchemy.init_app(self, app)
+    self.replicas.init_app(app)
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
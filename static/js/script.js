@@ -2,3 +2,65 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Search-as-you-type: once typing pauses for TYPEAHEAD_DELAY ms, fetch name
+// suggestions for inputs with a data-typeahead URL into their datalist. A
+// newer lookup aborts the one still in flight.
+var TYPEAHEAD_DELAY = 250;
+
+window.debounce = function debounce(fn, wait) {
+  var timer = null;
+  return function() {
+    var args = arguments, self = this;
+    clearTimeout(timer);
+    timer = setTimeout(function() { fn.apply(self, args); }, wait);
+  };
+};
+
+Array.prototype.forEach.call(document.querySelectorAll('input[data-typeahead]'), function(input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var controller = null;
+
+  input.addEventListener('input', debounce(function() {
+    var term = input.value.trim();
+    if (controller) {
+      controller.abort();
+      controller = null;
+    }
+    if (!term) {
+      list.innerHTML = '';
+      return;
+    }
+    controller = new AbortController();
+    fetch(input.dataset.typeahead + '?q=' + encodeURIComponent(term), { signal: controller.signal })
+      .then(function(response) { return response.json(); })
+      .then(function(body) {
+        list.innerHTML = '';
+        body.data.forEach(function(item) {
+          var option = document.createElement('option');
+          option.value = item.name;
+          list.appendChild(option);
+        });
+      })
+      .catch(function(error) {
+        if (error.name !== 'AbortError') {
+          console.error(error);
+        }
+      });
+  }, TYPEAHEAD_DELAY));
+});
+
+// "Near me" on the venue listing and search: fill in the browser's position
+// and resubmit the form, which then lists venues closest first.
+Array.prototype.forEach.call(document.querySelectorAll('.near-me'), function(button) {
+  button.addEventListener('click', function() {
+    var form = button.form;
+    navigator.geolocation.getCurrentPosition(function(position) {
+      form.elements.lat.value = position.coords.latitude.toFixed(4);
+      form.elements.lng.value = position.coords.longitude.toFixed(4);
+      form.submit();
+    }, function(error) {
+      console.error(error);
+    });
+  });
+});
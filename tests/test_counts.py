@@ -0,0 +1,109 @@
+import datetime
+import os
+import unittest
+
+# Runs against a scratch PostgreSQL database (the schema needs pg_trgm,
+# btree_gist and array columns), e.g.
+#   TEST_DATABASE_URI=postgres://postgres@localhost:5432/fyyur_test python -m pytest tests
+TEST_DATABASE_URI = os.environ.get('TEST_DATABASE_URI')
+
+if TEST_DATABASE_URI:
+  from app import app, db, Venue, Artist, Show
+
+def setUpModule():
+  if TEST_DATABASE_URI:
+    app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+    app.config['WTF_CSRF_ENABLED'] = False
+
+@unittest.skipUnless(TEST_DATABASE_URI, 'set TEST_DATABASE_URI to a scratch PostgreSQL database')
+class UpcomingShowsCountTest(unittest.TestCase):
+  # upcoming_shows_count is maintained by the writers rather than computed
+  # per page; these check that it follows creates and deletes, and that
+  # `flask recount` finds and repairs drift.
+
+  def setUp(self):
+    self.context = app.app_context()
+    self.context.push()
+    db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    db.session.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    db.session.commit()
+    db.drop_all()
+    db.create_all()
+    self.venues = [Venue(name=f'Venue {i}', city='San Francisco', state='CA', address='1 Main St',
+                         genres=['Jazz']) for i in range(2)]
+    self.artists = [Artist(name=f'Artist {i}', city='San Francisco', state='CA', genres=['Jazz'])
+                    for i in range(2)]
+    db.session.add_all(self.venues + self.artists)
+    db.session.commit()
+    # Requests close the shared session, detaching these objects.
+    self.venues = [venue.id for venue in self.venues]
+    self.artists = [artist.id for artist in self.artists]
+    self.client = app.test_client()
+    self.runner = app.test_cli_runner()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all()
+    self.context.pop()
+
+  def counts(self):
+    db.session.expire_all()
+    return ([venue.upcoming_shows_count for venue in Venue.query.order_by(Venue.id)],
+            [artist.upcoming_shows_count for artist in Artist.query.order_by(Artist.id)])
+
+  def create_show(self, venue_id, artist_id, start_time):
+    return self.client.post('/shows/create', data={
+      'venue_id': venue_id, 'artist_id': artist_id,
+      'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'), 'duration': 60})
+
+  def test_create_show_counts_upcoming_only(self):
+    tomorrow = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(days=1)
+    self.assertEqual(self.create_show(self.venues[0], self.artists[0], tomorrow).status_code, 200)
+    self.assertEqual(self.counts(), ([1, 0], [1, 0]))
+    self.assertEqual(self.create_show(self.venues[1], self.artists[0], tomorrow - datetime.timedelta(days=7)).status_code, 200)
+    self.assertEqual(self.counts(), ([1, 0], [1, 0]))
+
+  def test_create_show_for_missing_artist_is_refused(self):
+    tomorrow = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(days=1)
+    response = self.create_show(self.venues[0], self.artists[-1] + 1, tomorrow)
+    self.assertEqual(response.status_code, 400)
+    self.assertIn(b'There is no artist with that ID.', response.data)
+    self.assertEqual(self.counts(), ([0, 0], [0, 0]))
+
+  def test_delete_venue_decrements_its_artists(self):
+    tomorrow = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(days=1)
+    self.create_show(self.venues[0], self.artists[0], tomorrow)
+    self.create_show(self.venues[0], self.artists[1], tomorrow + datetime.timedelta(days=1))
+    self.create_show(self.venues[1], self.artists[1], tomorrow + datetime.timedelta(days=2))
+    self.assertEqual(self.counts(), ([2, 1], [1, 2]))
+    self.assertEqual(self.client.delete(f'/venues/{self.venues[0]}').status_code, 200)
+    self.assertEqual(self.counts(), ([1], [0, 1]))
+
+  def test_recount_repairs_planted_drift(self):
+    tomorrow = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(days=1)
+    self.create_show(self.venues[0], self.artists[0], tomorrow)
+    self.assertEqual(self.runner.invoke(args=['recount', '--check']).exit_code, 0)
+    db.session.execute(Venue.__table__.update().where(Venue.id == self.venues[1]).values(upcoming_shows_count=5))
+    db.session.commit()
+    self.assertEqual(self.runner.invoke(args=['recount', '--check']).exit_code, 1)
+    result = self.runner.invoke(args=['recount'])
+    self.assertIn('Repaired 1 venues and 0 artists', result.output)
+    self.assertEqual(self.counts(), ([1, 0], [1, 0]))
+    self.assertEqual(self.runner.invoke(args=['recount', '--check']).exit_code, 0)
+
+  def test_check_accepts_shows_started_since_the_last_roll(self):
+    # Counted as upcoming when created; the show has since started but
+    # roll-shows has not run yet.
+    start_time = datetime.datetime.now() - datetime.timedelta(minutes=10)
+    db.session.add(Show(venue_id=self.venues[0], artist_id=self.artists[0],
+                        start_time=start_time, end_time=start_time + datetime.timedelta(hours=2)))
+    db.session.execute(Venue.__table__.update().where(Venue.id == self.venues[0]).values(upcoming_shows_count=1))
+    db.session.execute(Artist.__table__.update().where(Artist.id == self.artists[0]).values(upcoming_shows_count=1))
+    db.session.commit()
+    self.assertEqual(self.runner.invoke(args=['recount', '--check']).exit_code, 0)
+    self.assertEqual(self.runner.invoke(args=['recount', '--check', '--window-minutes', '5']).exit_code, 1)
+    self.runner.invoke(args=['roll-shows'])
+    self.assertEqual(self.counts(), ([0, 0], [0, 0]))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,103 @@
+import random
+import unittest
+
+from flask import Flask
+
+from matchmaking import Matchmaker
+
+GENRES = ['Jazz', 'Blues', 'Folk', 'Rock n Roll', 'Classical', 'Hip-Hop']
+PLACES = [('San Francisco', 'CA'), ('Oakland', 'CA'), ('New York', 'NY'), ('Austin', 'TX')]
+
+class Catalog:
+  # In-memory venues and artists, each id -> [genres, city, state, seeking],
+  # plus symmetric show histories, served to a Matchmaker through its loaders.
+
+  def __init__(self, rng, venues, artists):
+    self.rng = rng
+    self.entities = {'venue': {}, 'artist': {}}
+    self.shows = {}
+    for kind, count in (('venue', venues), ('artist', artists)):
+      for entity_id in range(1, count + 1):
+        self.entities[kind][entity_id] = self.random_profile()
+    for _ in range(venues * 2):
+      pair = (rng.randint(1, venues), rng.randint(1, artists))
+      self.shows[pair] = self.shows.get(pair, 0) + 1
+
+  def random_profile(self):
+    city, state = self.rng.choice(PLACES)
+    return [self.rng.sample(GENRES, self.rng.randint(0, 3)), city, state, self.rng.random() < 0.7]
+
+  def matchmaker(self, limit):
+    app = Flask(__name__)
+    app.config.update(MATCH_CANDIDATES=limit, MATCH_REFRESH_SECONDS=0)
+    matchmaker = Matchmaker(app)
+    for kind in ('venue', 'artist'):
+      matchmaker.register(kind, lambda kind=kind: self.profiles(kind), lambda entity_id, kind=kind: self.history(kind, entity_id))
+    return matchmaker
+
+  def profiles(self, kind):
+    return [(entity_id, genres, city, state) for entity_id, (genres, city, state, seeking) in self.entities[kind].items() if seeking]
+
+  def history(self, kind, entity_id):
+    side = 0 if kind == 'venue' else 1
+    return {pair[1 - side]: count for pair, count in self.shows.items() if pair[side] == entity_id}
+
+  def seeking(self, kind):
+    return [entity_id for entity_id, profile in self.entities[kind].items() if profile[3]]
+
+  def recommend(self, matchmaker, kind, entity_id, limit=None):
+    genres, city, state, _ = self.entities[kind][entity_id]
+    return matchmaker.recommend(kind, entity_id, genres, city, state, limit)
+
+class MatchmakerTest(unittest.TestCase):
+
+  def assertSameRanking(self, patched, recomputed, message):
+    self.assertEqual([candidate for _, candidate in patched], [candidate for _, candidate in recomputed], message)
+    for (score, _), (expected, _) in zip(patched, recomputed):
+      self.assertAlmostEqual(score, expected, places=9, msg=message)
+
+  def test_patched_lists_match_full_recompute(self):
+    # profile_changed() patches the cached lists in place; after any series
+    # of edits, creates and deletes they must equal a fresh computation.
+    # Only seeking entities are asked, as the recommendations API does.
+    for seed in range(10):
+      rng = random.Random(seed)
+      catalog = Catalog(rng, venues=rng.randint(5, 30), artists=rng.randint(5, 30))
+      limit = rng.randint(1, 8)
+      matchmaker = catalog.matchmaker(limit)
+      for kind in ('venue', 'artist'):
+        for entity_id in catalog.seeking(kind):
+          catalog.recommend(matchmaker, kind, entity_id)
+
+      for step in range(40):
+        kind = rng.choice(('venue', 'artist'))
+        entities = catalog.entities[kind]
+        if rng.random() < 0.15:
+          entity_id = max(entities) + 1
+          entities[entity_id] = catalog.random_profile()
+        else:
+          entity_id = rng.choice(list(entities))
+          if rng.random() < 0.15:
+            entities[entity_id][3] = False
+          else:
+            entities[entity_id] = catalog.random_profile()
+        genres, city, state, seeking = entities[entity_id]
+        matchmaker.profile_changed(kind, entity_id, genres, city, state, seeking=seeking)
+
+        recomputed = catalog.matchmaker(limit)
+        for other in ('venue', 'artist'):
+          for other_id in catalog.seeking(other):
+            self.assertSameRanking(catalog.recommend(matchmaker, other, other_id),
+                                   catalog.recommend(recomputed, other, other_id),
+                                   f'seed {seed}, step {step}: {other} {other_id}')
+
+  def test_limit_is_clamped(self):
+    catalog = Catalog(random.Random(0), venues=10, artists=40)
+    matchmaker = catalog.matchmaker(5)
+    venue_id = next(entity_id for entity_id in catalog.seeking('venue') if len(catalog.recommend(matchmaker, 'venue', entity_id)) == 5)
+    self.assertEqual(len(catalog.recommend(matchmaker, 'venue', venue_id, limit=-3)), 1)
+    self.assertEqual(len(catalog.recommend(matchmaker, 'venue', venue_id, limit=0)), 5)
+    self.assertEqual(len(catalog.recommend(matchmaker, 'venue', venue_id, limit=100)), 5)
+
+if __name__ == '__main__':
+  unittest.main()
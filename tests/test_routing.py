@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+from sqlalchemy.pool import QueuePool
+
+from routing import RoutingSQLAlchemy, reads_from_replica
+
+# A stand-alone app over three SQLite files standing in for the primary and
+# two replicas. Each database holds one `origin` row naming it, so a view
+# reading that row shows which database served the request.
+
+def make_app(directory, balancing='round_robin'):
+  app = Flask(__name__)
+  app.config.update(
+    SECRET_KEY='test',
+    SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'primary.db'),
+    SQLALCHEMY_REPLICA_URIS=['sqlite:///' + os.path.join(directory, f'replica{i}.db') for i in (1, 2)],
+    # QueuePool rather than SQLite's default NullPool, for checkedout().
+    SQLALCHEMY_ENGINE_OPTIONS={'poolclass': QueuePool},
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    REPLICA_BALANCING=balancing,
+    REPLICA_STICKY_SECONDS=60,
+  )
+  db = RoutingSQLAlchemy(app)
+
+  class Origin(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+  with app.app_context():
+    for name, engine in [('primary', db.engine)] + [(f'replica{i}', e) for i, e in enumerate(db.replicas.engines, 1)]:
+      Origin.__table__.create(engine)
+      engine.execute(Origin.__table__.insert(), name=name, hits=0)
+
+  def origin():
+    return db.session.query(Origin.name).filter(Origin.id == 1).scalar()
+
+  @app.route('/read')
+  @reads_from_replica
+  def read():
+    return origin()
+
+  @app.route('/read-primary')
+  def read_primary():
+    return origin()
+
+  @app.route('/flush', methods=['POST'])
+  @reads_from_replica
+  def flush():
+    db.session.add(Origin(name='flushed'))
+    db.session.flush()
+    name = origin()
+    db.session.commit()
+    return name
+
+  @app.route('/bulk', methods=['POST'])
+  @reads_from_replica
+  def bulk():
+    Origin.query.filter(Origin.id == 1).update({Origin.hits: Origin.hits + 1}, synchronize_session=False)
+    name = origin()
+    db.session.commit()
+    return name
+
+  app.db, app.Origin = db, Origin
+  return app
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def app(self, balancing='round_robin'):
+    app = make_app(self.directory, balancing)
+    self.addCleanup(lambda: [engine.dispose() for engine in app.db.replicas.engines + [app.db.get_engine(app)]])
+    return app
+
+  def get(self, client, path):
+    return client.get(path).get_data(as_text=True)
+
+  def hits(self, app):
+    # The update counter of row 1 in every database, primary first.
+    with app.app_context():
+      engines = [app.db.engine] + app.db.replicas.engines
+      return [engine.execute('SELECT hits FROM origin WHERE id = 1').scalar() for engine in engines]
+
+  def test_replica_views_read_from_a_replica(self):
+    app = self.app()
+    self.assertIn(self.get(app.test_client(), '/read'), ('replica1', 'replica2'))
+    self.assertEqual(self.get(app.test_client(), '/read-primary'), 'primary')
+
+  def test_round_robin_alternates_replicas(self):
+    app = self.app('round_robin')
+    reads = [self.get(app.test_client(), '/read') for _ in range(4)]
+    self.assertEqual(reads, ['replica1', 'replica2', 'replica1', 'replica2'])
+
+  def test_least_connections_avoids_busy_replica(self):
+    app = self.app('least_connections')
+    with app.app_context():
+      busy = app.db.replicas.engines[0].connect()
+    try:
+      self.assertEqual([self.get(app.test_client(), '/read') for _ in range(3)], ['replica2'] * 3)
+    finally:
+      busy.close()
+    with app.app_context():
+      busy = app.db.replicas.engines[1].connect()
+    try:
+      self.assertEqual(self.get(app.test_client(), '/read'), 'replica1')
+    finally:
+      busy.close()
+
+  def test_flush_goes_to_primary(self):
+    app = self.app()
+    # The read after the flush stays on the primary too.
+    self.assertEqual(app.test_client().post('/flush').get_data(as_text=True), 'primary')
+    with app.app_context():
+      counts = [engine.execute("SELECT count(*) FROM origin WHERE name = 'flushed'").scalar()
+                for engine in [app.db.engine] + app.db.replicas.engines]
+    self.assertEqual(counts, [1, 0, 0])
+
+  def test_bulk_dml_goes_to_primary(self):
+    app = self.app()
+    self.assertEqual(app.test_client().post('/bulk').get_data(as_text=True), 'primary')
+    self.assertEqual(self.hits(app), [1, 0, 0])
+
+  def test_writer_reads_from_primary_until_sticky_window_ends(self):
+    app = self.app()
+    writer, other = app.test_client(), app.test_client()
+    writer.post('/bulk')
+    self.assertEqual(self.get(writer, '/read'), 'primary')
+    self.assertIn(self.get(other, '/read'), ('replica1', 'replica2'))
+    with writer.session_transaction() as session:
+      session['primary_until'] = 0
+    self.assertIn(self.get(writer, '/read'), ('replica1', 'replica2'))
+
+if __name__ == '__main__':
+  unittest.main()
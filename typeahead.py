@@ -0,0 +1,133 @@
+import bisect
+import re
+import threading
+import time
+
+WORD = re.compile(r'\w+')
+
+def normalize(text):
+  return ' '.join(WORD.findall(text.casefold()))
+
+class PrefixIndex:
+  # Sorted (key, id) pairs for prefix lookups by bisection. Every name is
+  # indexed under its full normalized form and under each word after the
+  # first, so "hop" finds "The Musical Hop". Full-name matches rank first.
+
+  def __init__(self):
+    self.names = []
+    self.words = []
+    self.entries = {}
+    self.lock = threading.Lock()
+
+  def build(self, rows):
+    # rows: iterable of (id, name).
+    names, words, entries = [], [], {}
+    for entity_id, name in rows:
+      keys = self._keys(name)
+      entries[entity_id] = (name, keys)
+      names.append((keys[0], entity_id))
+      words.extend((key, entity_id) for key in keys[1:])
+    names.sort()
+    words.sort()
+    with self.lock:
+      self.names, self.words, self.entries = names, words, entries
+
+  @staticmethod
+  def _keys(name):
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+  def add(self, entity_id, name):
+    # Adds or, for an existing id, renames an entry.
+    with self.lock:
+      self._remove(entity_id)
+      keys = self._keys(name)
+      self.entries[entity_id] = (name, keys)
+      bisect.insort(self.names, (keys[0], entity_id))
+      for key in keys[1:]:
+        bisect.insort(self.words, (key, entity_id))
+
+  def remove(self, entity_id):
+    with self.lock:
+      self._remove(entity_id)
+
+  def _remove(self, entity_id):
+    entry = self.entries.pop(entity_id, None)
+    if entry is None:
+      return
+    keys = entry[1]
+    for pairs, pair_keys in ((self.names, keys[:1]), (self.words, keys[1:])):
+      for key in pair_keys:
+        index = bisect.bisect_left(pairs, (key, entity_id))
+        if index < len(pairs) and pairs[index] == (key, entity_id):
+          del pairs[index]
+
+  def complete(self, prefix, limit):
+    # Up to `limit` (id, name) pairs whose name, or a word in it, starts
+    # with `prefix`; alphabetical within each group.
+    prefix = normalize(prefix)
+    if not prefix:
+      return []
+    results, seen = [], set()
+    with self.lock:
+      for pairs in (self.names, self.words):
+        index = bisect.bisect_left(pairs, (prefix,))
+        while len(results) < limit and index < len(pairs) and pairs[index][0].startswith(prefix):
+          entity_id = pairs[index][1]
+          if entity_id not in seen:
+            seen.add(entity_id)
+            results.append((entity_id, self.entries[entity_id][0]))
+          index += 1
+    return results
+
+  def __len__(self):
+    return len(self.entries)
+
+class Typeahead:
+  # A PrefixIndex per kind of entity, loaded on first use with the loader
+  # given to register() and kept current by writers calling add() and
+  # remove() after committing.
+  #
+  # Like the in-memory page cache, each worker process holds its own copy
+  # and only sees the writes it handled, so indexes are also reloaded every
+  # TYPEAHEAD_REFRESH_SECONDS (0 disables reloading).
+
+  def __init__(self, app=None):
+    self.indexes = {}
+    self.loaders = {}
+    self.loaded_at = {}
+    self.limit = 10
+    self.refresh_seconds = 0
+    self.lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.limit = app.config.get('TYPEAHEAD_LIMIT', 10)
+    self.refresh_seconds = app.config.get('TYPEAHEAD_REFRESH_SECONDS', 300)
+
+  def register(self, kind, loader):
+    # loader() returns an iterable of (id, name) for every entity of `kind`.
+    self.loaders[kind] = loader
+    self.indexes[kind] = PrefixIndex()
+
+  def index(self, kind):
+    loaded_at = self.loaded_at.get(kind)
+    if loaded_at is None or (self.refresh_seconds and time.monotonic() - loaded_at >= self.refresh_seconds):
+      with self.lock:
+        if self.loaded_at.get(kind) == loaded_at:
+          self.indexes[kind].build(self.loaders[kind]())
+          self.loaded_at[kind] = time.monotonic()
+    return self.indexes[kind]
+
+  def complete(self, kind, prefix, limit=None):
+    return self.index(kind).complete(prefix, max(1, min(limit or self.limit, self.limit)))
+
+  def add(self, kind, entity_id, name):
+    # Nothing to do before the first load, which reads the committed rows.
+    if kind in self.loaded_at:
+      self.indexes[kind].add(entity_id, name)
+
+  def remove(self, kind, entity_id):
+    if kind in self.loaded_at:
+      self.indexes[kind].remove(entity_id)